@@ -8,42 +8,64 @@ from aiogram.types import Message
 from aiogram import F, Router
 from dotenv import load_dotenv
 from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, CallbackQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, CallbackQuery, FSInputFile
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from datetime import datetime, timedelta
-import sqlite3
+import db
+from callbacks import (
+    CallbackRouter, ViewDate, CancelDate, BookingsPage, ExportRange, AdminSelect, AdminCancel,
+    AdminCancelSelected, AdminConfirmCancel, AdminCancelBack, AdminConfirmClose, pack_date, unpack_date, pack_stamp,
+    unpack_stamp,
+)
+import analytics
+import export
+from closures import closures, WHOLE_DAY
+from reservations import reservations
+import metrics
+from slot_cache import cache as slot_cache
+from schedule import schedule, horizon_end
+from reminders import scheduler as reminder_scheduler
+from user_summary import summaries
+from waitlist import waitlist
 
 
 load_dotenv()
 ADMIN_ID = int(os.getenv("ADMIN_ID")) 
 
-conn = sqlite3.connect("database.db")
-cursor = conn.cursor()
-
 router = Router()
+callback_router = CallbackRouter()
+callback_router.setup(router)
 
 admin_menu = ReplyKeyboardBuilder()
 admin_menu.button(text="📆 All bookings")
 admin_menu.button(text="📅 Bookings by date")
 admin_menu.button(text="❌ Cancel booking")
+admin_menu.button(text="📤 Export bookings")
+admin_menu.button(text="📊 Stats")
+admin_menu.button(text="🚫 Close days")
 admin_menu.adjust(1)
 
+BOOKINGS_PAGE_SIZE = 10
+
 
-def get_admin_date_keyboard(mode: str = "view"):
+async def get_admin_date_keyboard(mode: str = "view"):
     today = datetime.now().date()
     buttons = []
 
     valid_days_found = 0
     current_day = today
 
-    while valid_days_found < 7:
-        if current_day.weekday() < 6:
+    while valid_days_found < 7 and current_day <= horizon_end(today):
+        if schedule.is_working_day(current_day):
             date_str = current_day.strftime("%Y-%m-%d")
-            cursor.execute("SELECT COUNT(*) FROM appointments WHERE date = ?", (date_str,))
-            count = cursor.fetchone()[0]
+            count = await slot_cache.booked_count(date_str)
+            closed = await slot_cache.closed_masks(date_str)
 
             label = f"{current_day.strftime('%d.%m.%Y')} — {count} bookings"
-            callback = f"{mode}_date:{date_str}"  # вот тут ключевой момент
+            if closed and not any(schedule.free_masks(current_day, closed).values()):
+                label += ", 🚫 closed"
+            date_callback = ViewDate if mode == "view" else CancelDate
+            callback = date_callback(day=pack_date(date_str)).pack()
             buttons.append([InlineKeyboardButton(text=label, callback_data=callback)])
             valid_days_found += 1
 
@@ -52,25 +74,98 @@ def get_admin_date_keyboard(mode: str = "view"):
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def _page_button(scope: str, prev: bool, appointment) -> str:
+    # Курсор — ключ слота (date, time, barber_id) последней показанной записи
+    return BookingsPage(
+        day=0 if scope == "all" else pack_date(scope), prev=prev,
+        stamp=pack_stamp(appointment.date, appointment.time), barber=appointment.barber_id
+    ).pack()
+
+
+def _barber_suffix(appointment) -> str:
+    return f", 💈 {schedule.barber_name(appointment.barber_id)}" if len(schedule.barbers) > 1 else ""
+
+
+async def get_bookings_page(scope: str, direction: str = "n", cursor: tuple[str, str, int] = None):
+    # scope — "all" или дата "YYYY-MM-DD"; direction — "n" (вперёд) или "p" (назад)
+    date = None if scope == "all" else scope
+    backwards = direction == "p"
+    rows = await db.get_appointments_page(date, cursor, backwards, BOOKINGS_PAGE_SIZE + 1)
+
+    # Лишняя строка показывает, есть ли ещё записи в направлении листания
+    has_more = len(rows) > BOOKINGS_PAGE_SIZE
+    if has_more:
+        rows = rows[1:] if backwards else rows[:-1]
+    has_prev = has_more if backwards else cursor is not None
+    has_next = has_more if not backwards else True
+
+    if not rows:
+        return None, None
+
+    if date is None:
+        header = "📋 All appointments:"
+        lines = [f"📅 {row.date}, ⏰ {row.time}, 👤 {row.name}, 📞 {row.phone}{_barber_suffix(row)}" for row in rows]
+    else:
+        header = f"📅 Appointments on {date}:"
+        lines = [f"⏰ {row.time}, 👤 {row.name}, 📞 {row.phone}{_barber_suffix(row)}" for row in rows]
+    text = header + "\n\n" + "\n".join(lines)
+
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️ Prev", callback_data=_page_button(scope, True, rows[0])))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Next ➡️", callback_data=_page_button(scope, False, rows[-1])))
+    markup = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return text, markup
+
+
 @router.message(F.text == "/admin")
 async def admin_start(message: Message, state: FSMContext):
     if message.from_user.id == ADMIN_ID:
         await message.answer("🔐 Welcome to Admin Panel.", reply_markup=admin_menu.as_markup(resize_keyboard=True))
+        # Админ мог бросить собственную запись на полпути — слот не должен висеть удержанным
+        await reservations.release(message.from_user.id)
         await state.clear()
     else:
         await message.answer("🚫 You are not authorized to access this section.")
 
 
+@router.message(F.text == "/stats")
+async def show_stats(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    await message.answer(metrics.format_stats())
+
+
+@router.message(F.text == "📊 Stats")
+async def show_occupancy_stats(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    await message.answer(await analytics.occupancy_report())
+
+
+@router.message(F.text == "/rebuild_stats")
+async def rebuild_occupancy_stats(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    mismatches = await analytics.rebuild()
+    if mismatches:
+        details = "\n".join(mismatches[:20])
+        more = f"\n…and {len(mismatches) - 20} more" if len(mismatches) > 20 else ""
+        await message.answer(f"⚠️ Fixed {len(mismatches)} mismatched counters:\n{details}{more}")
+    else:
+        await message.answer("✅ Stats verified, all counters match.")
+
+
 @router.message(F.text == "📆 All bookings")
 async def show_all_bookings(message: Message):
-    cursor.execute("SELECT * FROM appointments ORDER BY date, time")
-    results = cursor.fetchall()
-
-    if results:
-        msg = "📋 All appointments:\n\n"
-        for row in results:
-            msg += f"📅 {row[2]}, ⏰ {row[3]}, 👤 {row[4]}, 📞 {row[5]}\n"
-        await message.answer(msg)
+    text, markup = await get_bookings_page("all")
+
+    if text:
+        await message.answer(text, reply_markup=markup)
     else:
         await message.answer("No appointments found.")
 
@@ -78,35 +173,268 @@ async def show_all_bookings(message: Message):
 async def show_admin_date_list(message: Message):
     await message.answer(
         "📅 Select a date to view bookings:",
-        reply_markup=get_admin_date_keyboard(mode="view")
+        reply_markup=await get_admin_date_keyboard(mode="view")
     )
 
 @router.message(F.text == "❌ Cancel booking")
 async def cancel_booking(message: Message):
     await message.answer(
         "❌ Select a booking date to cancel:",
-        reply_markup=get_admin_date_keyboard(mode="cancel")
+        reply_markup=await get_admin_date_keyboard(mode="cancel")
     )
 
 
 
-@router.callback_query(F.data.startswith("view_date:"))
-async def view_appointments_on_date(callback: CallbackQuery):
+@callback_router(ViewDate)
+async def view_appointments_on_date(callback: CallbackQuery, callback_data: ViewDate):
     await callback.message.edit_reply_markup()
-    date_str = callback.data.split(":")[1]
-    cursor.execute("SELECT * FROM appointments WHERE date = ?", (date_str,))
-    results = cursor.fetchall()
-
-    if results:
-        msg = f"📅 Appointments on {date_str}:\n\n"
-        for row in results:
-            msg += f"⏰ {row[3]}, 👤 {row[4]}, 📞 {row[5]}\n"
-        await callback.message.answer(msg)
+    date_str = unpack_date(callback_data.day)
+    text, markup = await get_bookings_page(date_str)
+
+    if text:
+        await callback.message.answer(text, reply_markup=markup)
     else:
         await callback.message.answer("No bookings found for this date.")
     await callback.answer()
 
 
+@callback_router(BookingsPage)
+async def turn_bookings_page(callback: CallbackQuery, callback_data: BookingsPage):
+    scope = unpack_date(callback_data.day) if callback_data.day else "all"
+    direction = "p" if callback_data.prev else "n"
+    cursor = (*unpack_stamp(callback_data.stamp), callback_data.barber)
+    text, markup = await get_bookings_page(scope, direction, cursor)
+
+    if text:
+        await callback.message.edit_text(text, reply_markup=markup)
+        await callback.answer()
+    else:
+        await callback.answer("No more bookings.")
+
+
+
+EXPORT_USAGE = (
+    "Usage: /export [csv|xlsx] [from YYYY-MM-DD] [to YYYY-MM-DD]\n"
+    "Without dates all bookings are exported, with one date — everything from that day on."
+)
+
+
+def _parse_export_args(args: list[str]) -> tuple[str, str, str]:
+    fmt = "csv"
+    if args and args[0].lower() in ("csv", "xlsx"):
+        fmt = args.pop(0).lower()
+    if len(args) > 2:
+        raise ValueError("too many arguments")
+    dates = [datetime.strptime(arg, "%Y-%m-%d").strftime("%Y-%m-%d") for arg in args]
+    start = dates[0] if dates else export.FIRST_DATE
+    end = dates[1] if len(dates) > 1 else export.LAST_DATE
+    if start > end:
+        raise ValueError("start date is after end date")
+    return fmt, start, end
+
+
+async def send_export(message: Message, fmt: str, start: str, end: str):
+    if fmt not in export.available_formats():
+        await message.answer("⚠️ XLSX export is not available on this server, use CSV.")
+        return
+    path, count = await export.export_appointments(fmt, start, end)
+    try:
+        period = "all time" if (start, end) == (export.FIRST_DATE, export.LAST_DATE) else f"{start} — {end}"
+        filename = f"bookings_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"📤 {count} bookings, {period}")
+    finally:
+        os.remove(path)
+
+
+@router.message(F.text.startswith("/export"))
+async def export_bookings(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    try:
+        fmt, start, end = _parse_export_args(message.text.split()[1:])
+    except ValueError:
+        await message.answer(EXPORT_USAGE)
+        return
+    await send_export(message, fmt, start, end)
+
+
+@router.message(F.text == "📤 Export bookings")
+async def show_export_menu(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    today = datetime.now().date()
+    ranges = [
+        ("This month", today.replace(day=1).strftime("%Y-%m-%d"), export.LAST_DATE),
+        ("Last 30 days", (today - timedelta(days=30)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")),
+        ("Everything", export.FIRST_DATE, export.LAST_DATE),
+    ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=f"{label} ({fmt.upper()})",
+                callback_data=ExportRange(fmt=fmt, start=pack_date(start), end=pack_date(end)).pack()
+            )
+            for fmt in export.available_formats()
+        ]
+        for label, start, end in ranges
+    ]
+    await message.answer(
+        "📤 Choose what to export:\n\n" + EXPORT_USAGE,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+@callback_router(ExportRange)
+async def export_bookings_range(callback: CallbackQuery, callback_data: ExportRange):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("🚫 Not allowed.")
+        return
+    await callback.answer("⏳ Preparing export...")
+    await send_export(
+        callback.message, callback_data.fmt, unpack_date(callback_data.start), unpack_date(callback_data.end)
+    )
+
+
+CLOSE_USAGE = (
+    "Usage: /close YYYY-MM-DD [YYYY-MM-DD] [HH:MM-HH:MM] [barber=ID] [reason]\n"
+    "Closes a day, a range of days or part of each day. Bookings in that time are cancelled "
+    "and clients are notified.\n"
+    "/reopen YYYY-MM-DD [YYYY-MM-DD] — make closed days bookable again."
+)
+
+
+def _parse_dates(args: list[str]) -> tuple[str, str]:
+    dates = []
+    while args and len(dates) < 2:
+        try:
+            dates.append(datetime.strptime(args[0], "%Y-%m-%d").strftime("%Y-%m-%d"))
+        except ValueError:
+            break
+        args.pop(0)
+    if not dates:
+        raise ValueError("date is required")
+    start, end = dates[0], dates[-1]
+    if start > end:
+        raise ValueError("start date is after end date")
+    return start, end
+
+
+def _parse_close_args(args: list[str]) -> dict:
+    start, end = _parse_dates(args)
+    today = datetime.now().strftime("%Y-%m-%d")
+    if end < today:
+        raise ValueError("dates are in the past")
+    # Прошедшие дни закрывать незачем; в сегодняшнем дне closures сами не трогают уже прошедшие визиты
+    start = max(start, today)
+    start_time, end_time = WHOLE_DAY
+    if args and "-" in args[0] and ":" in args[0]:
+        start_time, end_time = (datetime.strptime(t, "%H:%M").strftime("%H:%M") for t in args.pop(0).split("-"))
+        if start_time >= end_time:
+            raise ValueError("start time is after end time")
+    barber_id = None
+    if args and args[0].startswith("barber="):
+        barber_id = int(args.pop(0).split("=", 1)[1])
+        if barber_id not in schedule.barber_by_id:
+            raise ValueError("unknown barber")
+    reason = " ".join(args).strip() or None
+    return {
+        "start": start, "end": end, "start_time": start_time, "end_time": end_time,
+        "barber_id": barber_id, "reason": reason,
+    }
+
+
+def _days_between(start: str, end: str):
+    day = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
+
+
+def _describe_closure(request: dict) -> str:
+    start = datetime.strptime(request["start"], "%Y-%m-%d").strftime("%d.%m.%Y")
+    end = datetime.strptime(request["end"], "%Y-%m-%d").strftime("%d.%m.%Y")
+    text = start if start == end else f"{start} — {end}"
+    if (request["start_time"], request["end_time"]) != WHOLE_DAY:
+        text += f", {request['start_time']}–{request['end_time']}"
+    if request["barber_id"] is not None:
+        text += f", 💈 {schedule.barber_name(request['barber_id'])}"
+    if request["reason"]:
+        text += f" ({request['reason']})"
+    return text
+
+
+@router.message(F.text == "🚫 Close days")
+async def show_close_usage(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    await message.answer(CLOSE_USAGE)
+
+
+@router.message(F.text.startswith("/close"))
+async def ask_close_confirmation(message: Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    try:
+        request = _parse_close_args(message.text.split()[1:])
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}\n\n{CLOSE_USAGE}")
+        return
+    bookings, clients = await closures.preview(
+        request["start"], request["end"], request["start_time"], request["end_time"], request["barber_id"]
+    )
+    await state.update_data(close_request=request)
+    affected = f"{bookings} bookings will be cancelled and {clients} clients notified." if bookings else "No bookings are affected."
+    await message.answer(
+        f"🚫 Close {_describe_closure(request)}?\n\n{affected}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Close", callback_data=AdminConfirmClose(yes=True).pack())],
+            [InlineKeyboardButton(text="↩️ Keep open", callback_data=AdminConfirmClose(yes=False).pack())],
+        ])
+    )
+
+
+@callback_router(AdminConfirmClose)
+async def confirm_close(callback: CallbackQuery, callback_data: AdminConfirmClose, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("🚫 Not allowed.")
+        return
+    request = (await state.get_data()).get("close_request")
+    await state.update_data(close_request=None)
+    if not callback_data.yes or not request:
+        await callback.message.edit_text("⚠️ Please send /close again." if callback_data.yes else "Nothing was closed.")
+        await callback.answer()
+        return
+
+    dates = [day.strftime("%Y-%m-%d") for day in _days_between(request["start"], request["end"])]
+    cancelled = await closures.close(
+        dates, request["start_time"], request["end_time"], request["barber_id"], request["reason"]
+    )
+    summary = f"✅ Closed {_describe_closure(request)}, {len(cancelled)} bookings cancelled."
+    await callback.message.edit_text(summary)
+    await callback.answer()
+    if cancelled:
+        status = await callback.message.answer("📣 Notifying clients...")
+        closures.start_notification(callback.bot, cancelled, request["reason"], status)
+
+
+@router.message(F.text.startswith("/reopen"))
+async def reopen_days(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("🚫 You are not authorized to access this section.")
+        return
+    try:
+        start, end = _parse_dates(message.text.split()[1:])
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}\n\n{CLOSE_USAGE}")
+        return
+    removed = await closures.reopen(start, end)
+    await message.answer(f"✅ Reopened {removed} closed days." if removed else "Nothing was closed on these dates.")
+
 
 admin_router = router
 
@@ -114,71 +442,130 @@ admin_router = router
 # --- Admin cancellation handlers ---
 from aiogram.types import CallbackQuery
 
-@router.callback_query(F.data.startswith("cancel_date:"))
-async def show_bookings_for_cancellation(callback: CallbackQuery, state: FSMContext):
+async def get_cancellation_view(date_str: str, selected: list[int]):
+    # Одно сообщение на весь день: строка кнопок на каждую запись + отмена выбранных
+    results = await db.get_appointments_on_date(date_str)
+    if not results:
+        return None, None
+
+    lines = [f"⏰ {row.time}, 👤 {row.name}, 📞 {row.phone}" for row in results]
+    text = f"❌ Bookings on {date_str}:\n\n" + "\n".join(lines)
+
+    buttons = []
+    for row in results:
+        mark = "☑️" if row.id in selected else "⬜"
+        buttons.append([
+            InlineKeyboardButton(text=f"{mark} {row.time} {row.name}", callback_data=AdminSelect(id=row.id).pack()),
+            InlineKeyboardButton(text="❌ Cancel", callback_data=AdminCancel(id=row.id).pack()),
+        ])
+    selected_count = sum(1 for row in results if row.id in selected)
+    if selected_count:
+        buttons.append([
+            InlineKeyboardButton(text=f"🗑 Cancel selected ({selected_count})", callback_data=AdminCancelSelected().pack())
+        ])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+async def show_cancel_confirmation(callback: CallbackQuery, state: FSMContext, booking_ids: list[int]):
+    bookings = await db.get_appointments_by_ids(booking_ids)
+    if not bookings:
+        await callback.answer("⚠️ Booking not found or already cancelled.")
+        return
+    await state.update_data(cancel_booking_ids=[b.id for b in bookings])
+
+    lines = [f"📅 {b.date}, ⏰ {b.time}, 👤 {b.name}, 📞 {b.phone}" for b in bookings]
+    confirmation_kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Yes", callback_data=AdminConfirmCancel().pack())],
+        [InlineKeyboardButton(text="↩️ Go back", callback_data=AdminCancelBack().pack())]
+    ])
+    await callback.message.edit_text("Cancel these bookings?\n\n" + "\n".join(lines), reply_markup=confirmation_kb)
+    await state.set_state(AdminStates.AWAITING_CANCEL_CONFIRMATION)
+    await callback.answer()
+
+
+@callback_router(CancelDate)
+async def show_bookings_for_cancellation(callback: CallbackQuery, callback_data: CancelDate, state: FSMContext):
     await callback.message.edit_reply_markup()
-    date_str = callback.data.split(":")[1]
-    cursor.execute("SELECT * FROM appointments WHERE date = ?", (date_str,))
-    results = cursor.fetchall()
-
-    if results:
-        for row in results:
-            text = f"📅 {row[2]}, ⏰ {row[3]}, 👤 {row[4]}, 📞 {row[5]}"
-            cancel_btn = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Cancel", callback_data=f"admin_cancel:{row[0]}")]
-            ])
-            await callback.message.answer(text, reply_markup=cancel_btn)
+    date_str = unpack_date(callback_data.day)
+    await state.update_data(cancel_date=date_str, cancel_selected=[])
+    text, markup = await get_cancellation_view(date_str, [])
+
+    if text:
+        await callback.message.answer(text, reply_markup=markup)
     else:
         await callback.message.answer("No bookings found for this date.")
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("admin_cancel:"))
-async def ask_admin_cancel_confirmation(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_reply_markup()
-    booking_id = callback.data.split(":")[1]
-    await state.update_data(cancel_booking_id=booking_id)
+@callback_router(AdminSelect)
+async def toggle_booking_selection(callback: CallbackQuery, callback_data: AdminSelect, state: FSMContext):
+    booking_id = callback_data.id
+    data = await state.get_data()
+    date_str = data.get("cancel_date")
+    if not date_str:
+        await callback.answer("⚠️ Please choose the date again.")
+        return
+
+    selected = data.get("cancel_selected", [])
+    selected = [i for i in selected if i != booking_id] if booking_id in selected else selected + [booking_id]
+    await state.update_data(cancel_selected=selected)
+
+    text, markup = await get_cancellation_view(date_str, selected)
+    if text:
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text("No bookings found for this date.")
+    await callback.answer()
 
-    confirmation_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Yes", callback_data="admin_confirm_cancel")],
-        [InlineKeyboardButton(text="↩️ Go back", callback_data="admin_cancel_back")]
-    ])
-    await callback.message.edit_reply_markup(reply_markup=confirmation_kb)
-    await state.set_state(AdminStates.AWAITING_CANCEL_CONFIRMATION)
 
+@callback_router(AdminCancel)
+async def ask_admin_cancel_confirmation(callback: CallbackQuery, callback_data: AdminCancel, state: FSMContext):
+    await show_cancel_confirmation(callback, state, [callback_data.id])
 
-@router.callback_query(F.data == "admin_confirm_cancel")
-async def confirm_admin_cancel(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_reply_markup()
+
+@callback_router(AdminCancelSelected)
+async def ask_admin_bulk_cancel_confirmation(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    booking_id = data.get("cancel_booking_id")
+    await show_cancel_confirmation(callback, state, data.get("cancel_selected", []))
+
 
-    if booking_id:
-        cursor.execute("DELETE FROM appointments WHERE id = ?", (booking_id,))
-        conn.commit()
-        await callback.message.edit_text("✅ Booking has been cancelled.")
+@callback_router(AdminConfirmCancel)
+async def confirm_admin_cancel(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    booking_ids = data.get("cancel_booking_ids")
+    date_str = data.get("cancel_date")
+
+    if booking_ids:
+        cancelled = await db.delete_appointments(booking_ids)
+        for appointment in cancelled:
+            slot_cache.mark_free(appointment.date, appointment.time, appointment.barber_id)
+            reminder_scheduler.cancel(appointment.id)
+            summaries.on_cancelled(appointment)
+            waitlist.on_freed(appointment)
+
+        summary = "✅ Booking has been cancelled." if len(cancelled) == 1 else f"✅ {len(cancelled)} bookings have been cancelled."
+        text, markup = await get_cancellation_view(date_str, []) if date_str else (None, None)
+        await callback.message.edit_text(f"{summary}\n\n{text}" if text else summary, reply_markup=markup)
+        await state.set_state(None)
+        await state.update_data(cancel_booking_ids=None, cancel_selected=[])
     else:
+        await callback.message.edit_reply_markup()
         await callback.message.answer("⚠️ Booking not found or already cancelled.")
+        await state.clear()
 
-    await state.clear()
     await callback.answer()
 
 
-@router.callback_query(F.data == "admin_cancel_back")
+@callback_router(AdminCancelBack)
 async def cancel_back_to_booking(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_reply_markup()
     data = await state.get_data()
-    booking_id = data.get("cancel_booking_id")
-
-    if booking_id:
-        cursor.execute("SELECT * FROM appointments WHERE id = ?", (booking_id,))
-        booking = cursor.fetchone()
-        if booking:
-            text = f"📅 {booking[2]}, ⏰ {booking[3]}, 👤 {booking[4]}, 📞 {booking[5]}"
-            cancel_btn = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Cancel", callback_data=f"admin_cancel:{booking_id}")]
-            ])
-            await callback.message.edit_text(text, reply_markup=cancel_btn)
-
-    await state.clear()
+    date_str = data.get("cancel_date")
+    text, markup = await get_cancellation_view(date_str, data.get("cancel_selected", [])) if date_str else (None, None)
+
+    if text:
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text("No bookings found for this date.")
+
+    await state.set_state(None)
     await callback.answer()
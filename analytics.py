@@ -0,0 +1,161 @@
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import db
+import migrations
+from migrations import STATS_KEY_EXPRESSIONS, STATS_TABLES
+from schedule import schedule
+
+# strftime('%w'): 0 — воскресенье; показываем с понедельника
+WEEKDAY_NAMES = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+WEEKDAY_ORDER = [1, 2, 3, 4, 5, 6, 0]
+PAST_DAYS = 30
+NEXT_DAYS = 7
+
+
+def _compute_stats(conn) -> dict[str, dict]:
+    # Полный пересчёт: каждая когда-либо созданная запись сейчас либо активна, либо в архиве, либо отменена
+    result = {}
+    for table, (key, _) in STATS_TABLES.items():
+        expression = STATS_KEY_EXPRESSIONS[table].format(row="b")
+        rows = conn.execute(f'''
+            SELECT {expression}, COUNT(*), SUM(b.cancelled) FROM (
+                SELECT date, time, 0 AS cancelled FROM appointments
+                UNION ALL
+                SELECT date, time, 0 FROM appointment_history
+                UNION ALL
+                SELECT date, time, 1 FROM appointment_cancellations
+            ) b GROUP BY 1
+        ''').fetchall()
+        result[table] = {k: (booked, cancelled) for k, booked, cancelled in rows}
+    return result
+
+
+def _stored_stats(conn) -> dict[str, dict]:
+    result = {}
+    for table, (key, _) in STATS_TABLES.items():
+        rows = conn.execute(
+            f"SELECT {key}, booked, cancelled FROM {table} WHERE booked != 0 OR cancelled != 0"
+        ).fetchall()
+        result[table] = {k: (booked, cancelled) for k, booked, cancelled in rows}
+    return result
+
+
+def _diff(stored: dict[str, dict], actual: dict[str, dict]) -> list[str]:
+    problems = []
+    for table in STATS_TABLES:
+        for k in sorted(set(stored[table]) | set(actual[table]), key=str):
+            have, want = stored[table].get(k, (0, 0)), actual[table].get(k, (0, 0))
+            if have != want:
+                problems.append(f"{table}[{k}]: stored {have}, actual {want}")
+    return problems
+
+
+def verify_stats(conn) -> list[str]:
+    return _diff(_stored_stats(conn), _compute_stats(conn))
+
+
+def rebuild_stats(conn) -> list[str]:
+    # Пересчёт и замена в одной транзакции, чтобы новые записи не проскочили между ними
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        actual = _compute_stats(conn)
+        problems = _diff(_stored_stats(conn), actual)
+        for table, (key, _) in STATS_TABLES.items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(
+                f"INSERT INTO {table} ({key}, booked, cancelled) VALUES (?, ?, ?)",
+                [(k, booked, cancelled) for k, (booked, cancelled) in actual[table].items()]
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return problems
+
+
+def _read_report(conn, start: str, end: str) -> dict:
+    # Только маленькие агрегаты: 7 дней недели, по строке на слот и диапазон дней по первичному ключу
+    return {
+        "weekday": dict((k, (b, c)) for k, b, c in conn.execute("SELECT weekday, booked, cancelled FROM stats_weekday")),
+        "slot": dict((k, (b, c)) for k, b, c in conn.execute("SELECT time, booked, cancelled FROM stats_slot")),
+        "daily": dict((k, (b, c)) for k, b, c in conn.execute(
+            "SELECT date, booked, cancelled FROM stats_daily WHERE date BETWEEN ? AND ?", (start, end)
+        )),
+    }
+
+
+def _capacity(day) -> int:
+    return sum(schedule.working_mask(barber, day).bit_count() for barber in schedule.barbers)
+
+
+def _utilization(daily: dict, first_day, days: int) -> str:
+    active = capacity = 0
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        booked, cancelled = daily.get(day.strftime("%Y-%m-%d"), (0, 0))
+        active += booked - cancelled
+        capacity += _capacity(day)
+    if not capacity:
+        return "—"
+    return f"{active}/{capacity} slots ({active / capacity:.0%})"
+
+
+def _rate(booked: int, cancelled: int) -> str:
+    return f"{cancelled / booked:.0%}" if booked else "—"
+
+
+async def occupancy_report() -> str:
+    today = datetime.now().date()
+    past_start = today - timedelta(days=PAST_DAYS)
+    report = await db.database.run(
+        _read_report, past_start.strftime("%Y-%m-%d"), (today + timedelta(days=NEXT_DAYS - 1)).strftime("%Y-%m-%d")
+    )
+
+    booked = sum(b for b, _ in report["weekday"].values())
+    cancelled = sum(c for _, c in report["weekday"].values())
+    lines = [
+        "📊 Occupancy stats",
+        "",
+        f"All time: {booked} booked, {cancelled} cancelled ({_rate(booked, cancelled)})",
+        f"Last {PAST_DAYS} days: {_utilization(report['daily'], past_start, PAST_DAYS)}",
+        f"Next {NEXT_DAYS} days: {_utilization(report['daily'], today, NEXT_DAYS)}",
+        "",
+        "By weekday (active, cancel rate):",
+    ]
+    for weekday in WEEKDAY_ORDER:
+        b, c = report["weekday"].get(weekday, (0, 0))
+        if b:
+            lines.append(f"• {WEEKDAY_NAMES[weekday]}: {b - c}, {_rate(b, c)}")
+    lines.append("")
+    lines.append("By time slot (active, cancel rate):")
+    for time_str, (b, c) in sorted(report["slot"].items()):
+        if b:
+            lines.append(f"• {time_str}: {b - c}, {_rate(b, c)}")
+    return "\n".join(lines)
+
+
+async def verify() -> list[str]:
+    return await db.database.run(verify_stats)
+
+
+async def rebuild() -> list[str]:
+    return await db.database.run(rebuild_stats)
+
+
+if __name__ == "__main__":
+    # python analytics.py [verify|rebuild] [path] — сверить агрегаты с данными или пересчитать их с нуля
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    path = sys.argv[2] if len(sys.argv) > 2 else db.DB_PATH
+    if command not in ("verify", "rebuild"):
+        print("Usage: python analytics.py [verify|rebuild] [path]")
+        sys.exit(2)
+    connection = sqlite3.connect(path)
+    migrations.migrate(connection)
+    mismatches = rebuild_stats(connection) if command == "rebuild" else verify_stats(connection)
+    for line in mismatches:
+        print(f"❌ {line}")
+    print(f"{len(mismatches)} mismatches" + (", aggregates rebuilt" if command == "rebuild" else ""))
+    connection.close()
+    sys.exit(1 if mismatches and command == "verify" else 0)
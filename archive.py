@@ -0,0 +1,50 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db
+
+# Раз в ARCHIVE_INTERVAL секунд переносим прошедшие записи в appointment_history
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", str(60 * 60)))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Сколько прошедших дней оставлять в рабочей таблице (0 — всё, что раньше сегодняшнего дня)
+ARCHIVE_KEEP_DAYS = int(os.getenv("ARCHIVE_KEEP_DAYS", "0"))
+# Пауза между пачками, чтобы запись с хендлеров не ждала блокировку
+BATCH_PAUSE = 0.05
+
+
+class Archiver:
+    def __init__(
+        self, batch_size: int = ARCHIVE_BATCH_SIZE, interval: float = ARCHIVE_INTERVAL, keep_days: int = ARCHIVE_KEEP_DAYS
+    ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.keep_days = keep_days
+
+    def cutoff(self, now: Optional[datetime] = None) -> str:
+        now = now or datetime.now()
+        return (now.date() - timedelta(days=self.keep_days)).strftime("%Y-%m-%d")
+
+    async def archive(self, before_date: Optional[str] = None) -> int:
+        before_date = before_date or self.cutoff()
+        total = 0
+        while True:
+            moved = await db.archive_batch(before_date, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                return total
+            await asyncio.sleep(BATCH_PAUSE)
+
+    async def run(self):
+        while True:
+            try:
+                moved = await self.archive()
+                if moved:
+                    print(f"🗄 Archived {moved} past appointments")
+            except Exception as e:
+                print(f"❌ Failed to archive appointments: {e}")
+            await asyncio.sleep(self.interval)
+
+
+archiver = Archiver()
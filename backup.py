@@ -0,0 +1,219 @@
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+import db
+import metrics
+import migrations
+
+# Снимки: BACKUP_DIR/<имя базы>-ГГГГММДД-ЧЧММСС.db.gz, хранятся последние BACKUP_KEEP
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", str(6 * 60 * 60)))  # 0 — фоновое копирование выключено
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+# Копируем порциями страниц с паузой между ними, чтобы не забирать диск у запросов хендлеров
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+# Запись в базу посреди копирования заставляет SQLite начать заново; после стольких перезапусков
+# докопируем одним шагом — в WAL это не блокирует писателей, только дольше держит читающую транзакцию
+MAX_RESTARTS = 3
+RETRY_DELAY = 5 * 60
+SUFFIX = ".db.gz"
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _remove(*paths: str):
+    for path in paths:
+        for leftover in (path, path + "-journal", path + "-wal", path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def _check(conn: sqlite3.Connection):
+    result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if result != "ok":
+        raise sqlite3.DatabaseError(f"integrity check failed: {result}")
+
+
+def _copy(source_path: str, target_path: str, pages: int, pause: float) -> int:
+    # Отдельные соединения в отдельном потоке: пул базы всё это время обслуживает хендлеры
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(target_path)
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        time.sleep(pause)
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            source.backup(target)
+        _check(target)
+    finally:
+        target.close()
+        source.close()
+    return restarts
+
+
+def _compress(path: str, target_path: str):
+    part = target_path + ".part"
+    try:
+        with open(path, "rb") as src, gzip.open(part, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(part, target_path)
+    finally:
+        _remove(part)
+
+
+def snapshots(directory: str = BACKUP_DIR, source_path: str = db.DB_PATH) -> list[str]:
+    # Новые первыми: время в имени, поэтому порядок имён совпадает с порядком снимков
+    prefix = os.path.splitext(os.path.basename(source_path))[0] + "-"
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(SUFFIX)]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def create_snapshot(
+    source_path: str = db.DB_PATH,
+    directory: str = BACKUP_DIR,
+    keep: int = BACKUP_KEEP,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    pause: float = BACKUP_STEP_PAUSE,
+) -> tuple[str, int]:
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path = os.path.join(directory, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}{SUFFIX}")
+    raw_path = path[:-len(".gz")] + ".part"
+    try:
+        restarts = _copy(source_path, raw_path, pages, pause)
+        _compress(raw_path, path)
+    finally:
+        _remove(raw_path)
+    for old in snapshots(directory, source_path)[keep:]:
+        os.remove(old)
+    return path, restarts
+
+
+def _live_leader(conn: sqlite3.Connection) -> Optional[str]:
+    try:
+        row = conn.execute(
+            "SELECT holder FROM leases WHERE expires_at >= ? LIMIT 1", (time.time(),)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def restore_snapshot(snapshot_path: str, target_path: str = db.DB_PATH, force: bool = False):
+    # Снимок переносится внутрь базы тем же backup API, а не копированием файла поверх:
+    # SQLite сам возьмёт блокировку и не оставит рассинхронизированный -wal
+    part = target_path + ".restore"
+    opener = gzip.open if snapshot_path.endswith(".gz") else open
+    with opener(snapshot_path, "rb") as src, open(part, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    try:
+        snapshot = sqlite3.connect(part)
+        target = sqlite3.connect(target_path, timeout=30)
+        try:
+            _check(snapshot)
+            holder = _live_leader(target)
+            if holder and not force:
+                # Кеши запущенного бота (слоты, FSM, очередь напоминаний) разошлись бы с восстановленной базой
+                raise RuntimeError(f"bot is running ({holder}), stop it first or pass --force")
+            snapshot.backup(target)
+            # Снимок мог быть сделан до последних миграций
+            migrations.migrate(target)
+        finally:
+            target.close()
+            snapshot.close()
+    finally:
+        _remove(part)
+
+
+class BackupJob:
+    def __init__(self, interval: float = BACKUP_INTERVAL, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+
+    async def backup(self) -> str:
+        started = time.perf_counter()
+        metrics.backup_running.set(1)
+        try:
+            path, restarts = await asyncio.to_thread(
+                create_snapshot, db.database.path, self.directory, self.keep
+            )
+        except Exception:
+            metrics.backup_failures.inc()
+            raise
+        finally:
+            metrics.backup_running.set(0)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(path)
+        metrics.backup_duration.observe(elapsed)
+        metrics.backup_size.set(size)
+        metrics.backup_last_success.set(time.time())
+        restarted = f", restarted {restarts}x" if restarts else ""
+        print(f"💾 Backup {path} ({size / 1024:.0f} KB) in {elapsed:.1f}s{restarted}")
+        return path
+
+    def _next_delay(self) -> float:
+        # Отсчёт от последнего снимка на диске: перезапуск бота не сдвигает и не учащает копирование
+        existing = snapshots(self.directory, db.database.path)
+        if not existing:
+            return 0
+        return max(0.0, os.path.getmtime(existing[0]) + self.interval - time.time())
+
+    async def run(self):
+        if not self.interval:
+            return
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                await self.backup()
+            except Exception as e:
+                print(f"❌ Failed to back up the database: {e}")
+                await asyncio.sleep(min(self.interval, RETRY_DELAY))
+
+
+backup_job = BackupJob()
+
+
+if __name__ == "__main__":
+    # python backup.py [create|list] [db path]
+    # python backup.py restore <snapshot> [db path] [--force] — восстанавливать при остановленном боте
+    args = [arg for arg in sys.argv[1:] if arg != "--force"]
+    command = args[0] if args else "create"
+    if command == "create":
+        created, _ = create_snapshot(args[1] if len(args) > 1 else db.DB_PATH)
+        print(f"💾 {created} ({os.path.getsize(created) / 1024:.0f} KB)")
+    elif command == "list":
+        for snapshot in snapshots(BACKUP_DIR, args[1] if len(args) > 1 else db.DB_PATH):
+            print(f"{snapshot}\t{os.path.getsize(snapshot) / 1024:.0f} KB")
+    elif command == "restore" and len(args) > 1:
+        try:
+            restore_snapshot(args[1], args[2] if len(args) > 2 else db.DB_PATH, force="--force" in sys.argv)
+        except (RuntimeError, sqlite3.DatabaseError) as e:
+            print(f"❌ Restore failed: {e}")
+            sys.exit(1)
+        print(f"Restored {args[1]}")
+    else:
+        print("Usage: python backup.py [create|list] [db path] | restore <snapshot> [db path] [--force]")
+        sys.exit(2)
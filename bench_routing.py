@@ -0,0 +1,121 @@
+# Микробенчмарк маршрутизации callback-ов: прежняя цепочка F.data.startswith(...) против CallbackRouter.
+# Хендлеры пустые, Bot API не вызывается — меряется только путь апдейта от feed_update до хендлера.
+#
+#   python bench_routing.py --iterations 2000
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import callbacks
+from callbacks import CallbackRouter
+
+# (старый фильтр, старый payload, класс новых данных, новый payload) в порядке регистрации хендлеров
+MAIN_ROUTES = [
+    (F.data == "send_request", "send_request", callbacks.StartBooking, callbacks.StartBooking()),
+    (F.data.startswith("date:"), "date:2024-01-05", callbacks.PickDate, callbacks.PickDate(day=20240105)),
+    (F.data.startswith("time:"), "time:10:00", callbacks.PickTime, callbacks.PickTime(time=1000)),
+    (F.data.startswith("confirm:"), "confirm:yes", callbacks.Confirm, callbacks.Confirm(yes=True)),
+    (
+        F.data.startswith("hpage:"), "hpage:o:202401051000:17",
+        callbacks.HistoryPage, callbacks.HistoryPage(older=True, stamp=202401051000, id=17),
+    ),
+    (F.data.startswith("ask_cancel:"), "ask_cancel:17", callbacks.AskCancel, callbacks.AskCancel(id=17)),
+    (F.data.startswith("confirm_cancel:"), "confirm_cancel:17", callbacks.ConfirmCancel, callbacks.ConfirmCancel(id=17)),
+    (F.data == "cancel_back", "cancel_back", callbacks.CancelBack, callbacks.CancelBack()),
+]
+ADMIN_ROUTES = [
+    (F.data.startswith("view_date:"), "view_date:2024-01-05", callbacks.ViewDate, callbacks.ViewDate(day=20240105)),
+    (
+        F.data.startswith("apage:"), "apage:all:n:202401051000:1",
+        callbacks.BookingsPage, callbacks.BookingsPage(day=0, prev=False, stamp=202401051000, barber=1),
+    ),
+    (
+        F.data.startswith("export:"), "export:csv:2024-01-01:2024-01-31",
+        callbacks.ExportRange, callbacks.ExportRange(fmt="csv", start=20240101, end=20240131),
+    ),
+    (F.data.startswith("cancel_date:"), "cancel_date:2024-01-05", callbacks.CancelDate, callbacks.CancelDate(day=20240105)),
+    (F.data.startswith("admin_select:"), "admin_select:17", callbacks.AdminSelect, callbacks.AdminSelect(id=17)),
+    (F.data.startswith("admin_cancel:"), "admin_cancel:17", callbacks.AdminCancel, callbacks.AdminCancel(id=17)),
+    (F.data == "admin_cancel_selected", "admin_cancel_selected", callbacks.AdminCancelSelected, callbacks.AdminCancelSelected()),
+    (F.data == "admin_confirm_cancel", "admin_confirm_cancel", callbacks.AdminConfirmCancel, callbacks.AdminConfirmCancel()),
+    (F.data == "admin_cancel_back", "admin_cancel_back", callbacks.AdminCancelBack, callbacks.AdminCancelBack()),
+]
+
+
+async def legacy_handler(callback: CallbackQuery):
+    # Как раньше: каждый хендлер сам разбирает строку
+    return callback.data.split(":")
+
+
+async def typed_handler(callback: CallbackQuery, callback_data):
+    return callback_data
+
+
+def build_legacy() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    admin = Router()
+    for flt, *_ in MAIN_ROUTES:
+        dp.callback_query.register(legacy_handler, flt)
+    for flt, *_ in ADMIN_ROUTES:
+        admin.callback_query.register(legacy_handler, flt)
+    dp.include_router(admin)
+    return dp
+
+
+def build_typed() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    admin = Router()
+    main_table, admin_table = CallbackRouter(), CallbackRouter()
+    for _, _, data_cls, _ in MAIN_ROUTES:
+        main_table(data_cls)(typed_handler)
+    for _, _, data_cls, _ in ADMIN_ROUTES:
+        admin_table(data_cls)(typed_handler)
+    main_table.setup(dp)
+    admin_table.setup(admin)
+    dp.include_router(admin)
+    return dp
+
+
+def make_update(update_id: int, data: str) -> Update:
+    user = User(id=1, is_bot=False, first_name="Bench")
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"), text="...")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="1", message=message, data=data
+    ))
+
+
+async def measure(dp: Dispatcher, bot: Bot, payload: str, iterations: int) -> float:
+    updates = [make_update(i, payload) for i in range(iterations)]
+    for update in updates[:50]:  # прогрев
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(iterations: int):
+    bot = Bot(token="123456:BENCHMARK")
+    legacy, typed = build_legacy(), build_typed()
+    print(f"{'route':<24}{'legacy, µs':>12}{'typed, µs':>12}")
+    totals = [0.0, 0.0]
+    routes = MAIN_ROUTES + ADMIN_ROUTES
+    for _, old_payload, data_cls, new_data in routes:
+        old_cost = await measure(legacy, bot, old_payload, iterations)
+        new_cost = await measure(typed, bot, new_data.pack(), iterations)
+        totals[0] += old_cost
+        totals[1] += new_cost
+        print(f"{data_cls.__name__:<24}{old_cost:>12.1f}{new_cost:>12.1f}")
+    print(f"{'mean':<24}{totals[0] / len(routes):>12.1f}{totals[1] / len(routes):>12.1f}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Callback routing micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    asyncio.run(run(parser.parse_args().iterations))
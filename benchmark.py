@@ -0,0 +1,269 @@
+# Офлайн нагрузочный тест сценария записи: синтетические апдейты идут в dp.feed_update,
+# Bot API заменён заглушкой без сети. Печатает p50/p95/p99, запросы к БД на апдейт и пропускную способность.
+#
+#   python benchmark.py --users 1000 --concurrency 200
+#   python benchmark.py --save-baseline      # записать текущие цифры как эталон
+#   python benchmark.py --during-backup      # то же, пока в фоне без остановки снимается резервная копия
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Iterator
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Бот и база должны быть настроены до импорта main
+_tmp_dir = tempfile.mkdtemp(prefix="barbershop-bench-")
+os.environ["BOT_TOKEN"] = "123456:BENCHMARK"
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["DB_PATH"] = os.path.join(_tmp_dir, "bench.db")
+# У каждого виртуального пользователя свой слот — при тысяче пользователей это дальше обычного горизонта записи
+os.environ.setdefault("BOOKING_HORIZON_DAYS", "3650")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Message, Update, User  # noqa: E402
+
+import backup  # noqa: E402
+import db  # noqa: E402
+import main  # noqa: E402
+import metrics  # noqa: E402
+import outbox  # noqa: E402
+import throttling  # noqa: E402
+from callbacks import Confirm, PickDate, PickTime, StartBooking, pack_date, pack_time  # noqa: E402
+from schedule import schedule  # noqa: E402
+
+
+class StubSession(BaseSession):
+    # Отвечает на любой запрос к Bot API без сети
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.requests = 0
+        self.latency = latency
+        # Номера сообщений в каждом чате общие для пользователя и бота, как в Telegram
+        self.message_ids: dict[int, int] = {}
+        self.last_sent: dict[int, int] = {}
+
+    def next_message_id(self, chat_id: int) -> int:
+        self.message_ids[chat_id] = self.message_ids.get(chat_id, 0) + 1
+        return self.message_ids[chat_id]
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            # Имитация сетевого round trip до Bot API
+            await asyncio.sleep(self.latency)
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None) or 0
+        if name.startswith("Send"):
+            message_id = self.last_sent[chat_id] = self.next_message_id(chat_id)
+        elif name.startswith("Edit"):
+            message_id = method.message_id
+        else:
+            return True
+        return Message(message_id=message_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"))
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class QueryCounter:
+    def __init__(self, database):
+        self.count = 0
+        self._run = database.run
+        database.run = self.run
+
+    async def run(self, fn, *args):
+        self.count += 1
+        return await self._run(fn, *args)
+
+
+class VirtualUser:
+    def __init__(self, user_id: int, date_str: str, time_str: str, session: StubSession):
+        self.user_id = user_id
+        self.session = session
+        self.date_str = date_str
+        self.time_str = time_str
+        self._update_id = user_id * 100
+
+    def _user(self):
+        return User(id=self.user_id, is_bot=False, first_name="Bench")
+
+    def _chat(self):
+        return Chat(id=self.user_id, type="private")
+
+    def _next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def message(self, text: str) -> Update:
+        update_id = self._next_id()
+        return Update(update_id=update_id, message=Message(
+            message_id=self.session.next_message_id(self.user_id), date=datetime.now(), chat=self._chat(), from_user=self._user(), text=text
+        ))
+
+    def callback(self, data: str) -> Update:
+        # Кнопка нажата под последним сообщением бота в этом чате
+        update_id = self._next_id()
+        bot_message = Message(
+            message_id=self.session.last_sent.get(self.user_id, 0), date=datetime.now(), chat=self._chat(),
+            from_user=User(id=main.bot.id, is_bot=True, first_name="Bot"), text="..."
+        )
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), from_user=self._user(), chat_instance=str(self.user_id),
+            message=bot_message, data=data
+        ))
+
+    def script(self) -> Iterator[Update]:
+        # start_cmd → handle_send_request → process_date → process_time → process_name → process_phone → confirm.
+        # Апдейты создаются по одному, когда предыдущий обработан, — иначе неизвестно, под каким сообщением кнопки
+        yield self.message("/start")
+        yield self.callback(StartBooking().pack())
+        yield self.callback(PickDate(day=pack_date(self.date_str)).pack())
+        yield self.callback(Confirm(yes=True).pack())
+        yield self.callback(PickTime(time=pack_time(self.time_str)).pack())
+        yield self.callback(Confirm(yes=True).pack())
+        yield self.message("Bench")
+        yield self.callback(Confirm(yes=True).pack())
+        yield self.message("+37312345678")
+        yield self.callback(Confirm(yes=True).pack())
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_backups(directory: str, stop: asyncio.Event):
+    # Копия за копией, пока идёт нагрузка: латентность должна остаться той же, что и без них
+    job = backup.BackupJob(directory=directory, keep=1)
+    while not stop.is_set():
+        await job.backup()
+
+
+async def run_benchmark(users: int, concurrency: int, api_latency: float = 0.0, during_backup: bool = False) -> dict:
+    await db.init_db()
+    main.dp.include_router(main.admin_router)
+    session = StubSession(api_latency)
+    main.bot.session = session
+    throttling.setup(main.dp)
+    outbox.setup(main.dp, main.bot)
+    counter = QueryCounter(db.database)
+
+    # Каждому пользователю свой рабочий слот, чтобы все дошли до конца сценария
+    slots = []
+    day = datetime.now().date() + timedelta(days=2)
+    while len(slots) < users:
+        # Одно и то же время у разных барберов — разные слоты: второй пользователь займёт следующее кресло
+        for mask in schedule.free_masks(day, {}).values():
+            slots.extend((day.strftime("%Y-%m-%d"), time_str) for time_str in schedule.times(mask))
+        day += timedelta(days=1)
+    virtual_users = [VirtualUser(10_000 + i, *slots[i], session) for i in range(users)]
+
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_user(user: VirtualUser):
+        async with semaphore:
+            for update in user.script():
+                started = time.perf_counter()
+                await main.dp.feed_update(main.bot, update)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    stop_backups = asyncio.Event()
+    backups = asyncio.create_task(run_backups(os.path.join(_tmp_dir, "backups"), stop_backups)) if during_backup else None
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user) for user in virtual_users))
+    elapsed = time.perf_counter() - started
+    if backups is not None:
+        stop_backups.set()
+        await backups
+
+    await outbox.outbox.drain()
+    await main.dp.storage.close()
+    booked = await db.database.run(lambda conn: conn.execute("SELECT COUNT(*) FROM appointments").fetchone()[0])
+    db.database.close()
+    shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+    updates = len(latencies)
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "api_latency_ms": api_latency * 1000,
+        "backups": metrics.backup_duration.series.get((), [None, 0, 0])[2],
+        "updates": updates,
+        "booked": booked,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries_per_update": round(counter.count / updates, 3) if updates else 0,
+        "api_calls_per_update": round(session.requests / updates, 3) if updates else 0,
+        "updates_per_sec": round(updates / elapsed, 1) if elapsed else 0,
+    }
+
+
+# Для латентности и пропускной способности допускаем шум; число запросов почти детерминировано
+# (плавает только из-за отложенной записи FSM), поэтому для него допуск маленький
+COUNT_TOLERANCE = 0.1
+LOWER_IS_BETTER = ["p50_ms", "p95_ms", "p99_ms", "queries_per_update", "api_calls_per_update"]
+HIGHER_IS_BETTER = ["updates_per_sec"]
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for metric in LOWER_IS_BETTER:
+        slack = COUNT_TOLERANCE if metric.endswith("per_update") else tolerance
+        if metric in baseline and result[metric] > baseline[metric] * (1 + slack) + 1e-9:
+            regressions.append(f"{metric}: {baseline[metric]} -> {result[metric]}")
+    for metric in HIGHER_IS_BETTER:
+        if metric in baseline and result[metric] < baseline[metric] * (1 - tolerance):
+            regressions.append(f"{metric}: {baseline[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline load test for the booking FSM")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown for timings")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API round trip, ms")
+    parser.add_argument("--during-backup", action="store_true", help="take snapshots continuously during the run")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.users, args.concurrency, args.api_latency / 1000, args.during_backup))
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    recorded = (baseline.get("users"), baseline.get("concurrency"), baseline.get("api_latency_ms", 0.0))
+    if recorded != (args.users, args.concurrency, args.api_latency):
+        print("⚠️ Baseline was recorded with different --users/--concurrency/--api-latency, timings are not comparable")
+    regressions = compare(result, baseline, args.tolerance)
+    for line in regressions:
+        print(f"❌ Regression {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,173 @@
+import inspect
+from typing import Any, Awaitable, Callable, NamedTuple, Optional, Union
+
+from aiogram import Router
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+# Компактная запись: короткий префикс и числа вместо строк с разделителями,
+# "2024-01-05" -> 20240105, "10:00" -> 1000, "2024-01-05 10:00" -> 202401051000
+
+
+def pack_date(date_str: str) -> int:
+    return int(date_str.replace("-", ""))
+
+
+def unpack_date(value: int) -> str:
+    digits = f"{value:08d}"
+    return f"{digits[:4]}-{digits[4:6]}-{digits[6:]}"
+
+
+def pack_time(time_str: str) -> int:
+    return int(time_str.replace(":", ""))
+
+
+def unpack_time(value: int) -> str:
+    digits = f"{value:04d}"
+    return f"{digits[:2]}:{digits[2:]}"
+
+
+def pack_stamp(date_str: str, time_str: str) -> int:
+    return pack_date(date_str) * 10000 + pack_time(time_str)
+
+
+def unpack_stamp(value: int) -> tuple[str, str]:
+    return unpack_date(value // 10000), unpack_time(value % 10000)
+
+
+# --- клиентский сценарий ---
+
+class StartBooking(CallbackData, prefix="sr"):
+    pass
+
+
+class PickDate(CallbackData, prefix="d"):
+    day: int
+
+
+class PickTime(CallbackData, prefix="t"):
+    time: int
+
+
+class Confirm(CallbackData, prefix="c"):
+    yes: bool
+
+
+class HistoryPage(CallbackData, prefix="hp"):
+    older: bool
+    stamp: int
+    id: int
+
+
+class AskCancel(CallbackData, prefix="ac"):
+    id: int
+
+
+class ConfirmCancel(CallbackData, prefix="cc"):
+    id: int
+
+
+class CancelBack(CallbackData, prefix="cb"):
+    pass
+
+
+class JoinWaitlist(CallbackData, prefix="wl"):
+    day: int
+    time: Optional[int] = None  # None — любое время в этот день
+
+
+class ClaimOffer(CallbackData, prefix="wo"):
+    id: int
+
+
+# --- админка ---
+
+class ViewDate(CallbackData, prefix="vd"):
+    day: int
+
+
+class CancelDate(CallbackData, prefix="cd"):
+    day: int
+
+
+class BookingsPage(CallbackData, prefix="ap"):
+    day: int  # 0 — все записи
+    prev: bool
+    stamp: int
+    barber: int
+
+
+class ExportRange(CallbackData, prefix="ex"):
+    fmt: str
+    start: int
+    end: int
+
+
+class AdminSelect(CallbackData, prefix="as"):
+    id: int
+
+
+class AdminCancel(CallbackData, prefix="ax"):
+    id: int
+
+
+class AdminCancelSelected(CallbackData, prefix="axs"):
+    pass
+
+
+class AdminConfirmCancel(CallbackData, prefix="axc"):
+    pass
+
+
+class AdminCancelBack(CallbackData, prefix="axb"):
+    pass
+
+
+class AdminConfirmClose(CallbackData, prefix="clx"):
+    yes: bool
+
+
+class Route(NamedTuple):
+    data_cls: type[CallbackData]
+    handler: Callable[..., Awaitable[Any]]
+    params: frozenset[str]
+
+
+class CallbackRouter:
+    # Вместо цепочки F.data.startswith(...) — один хендлер на роутер и словарь префикс -> маршрут.
+    # Фильтр находит маршрут за O(1) и разбирает callback_data один раз; чужие префиксы
+    # пропускает дальше, во вложенные роутеры
+    def __init__(self):
+        self._routes: dict[str, Route] = {}
+
+    def __call__(self, data_cls: type[CallbackData]):
+        def decorator(handler):
+            prefix = data_cls.__prefix__
+            if prefix in self._routes:
+                raise ValueError(f"Callback prefix {prefix!r} is already routed")
+            params = list(inspect.signature(handler).parameters)[1:]
+            self._routes[prefix] = Route(data_cls, handler, frozenset(params))
+            return handler
+        return decorator
+
+    def match(self, callback: CallbackQuery) -> Union[bool, dict[str, Any]]:
+        data = callback.data
+        if not data:
+            return False
+        route = self._routes.get(data.split(":", 1)[0])
+        if route is None:
+            return False
+        try:
+            callback_data = route.data_cls.unpack(data)
+        except (TypeError, ValueError):
+            return False
+        return {"callback_data": callback_data, "callback_route": route}
+
+    async def dispatch(self, callback: CallbackQuery, callback_route: Route, **kwargs) -> Any:
+        # Хендлеру передаём только те аргументы, которые он объявил (state, callback_data, bot...)
+        return await callback_route.handler(
+            callback, **{name: kwargs[name] for name in callback_route.params if name in kwargs}
+        )
+
+    def setup(self, router: Router):
+        router.callback_query.register(self.dispatch, self.match)
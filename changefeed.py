@@ -0,0 +1,145 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import db
+from migrations import CHANGE_COLUMNS
+
+# Как часто каждый процесс дочитывает журнал; запрос — диапазон по первичному ключу
+CHANGEFEED_INTERVAL = float(os.getenv("CHANGEFEED_INTERVAL", "1"))
+CHANGEFEED_BATCH_SIZE = int(os.getenv("CHANGEFEED_BATCH_SIZE", "500"))
+# Сколько секунд журнал хранится; подписчик, отставший сильнее, перечитывает состояние целиком
+CHANGEFEED_RETENTION = float(os.getenv("CHANGEFEED_RETENTION", str(24 * 60 * 60)))
+PRUNE_INTERVAL = 60 * 60
+
+
+@dataclass
+class Change:
+    seq: int
+    op: str  # insert, update, delete (отмена) или archive (перенос в appointment_history)
+    appointment: db.Appointment
+
+
+@dataclass
+class Subscriber:
+    on_changes: Callable[[list[Change]], None]
+    # Вызывается, когда часть журнала уже удалена и дельт не хватает: подписчик сбрасывает своё состояние
+    on_reset: Optional[Callable[[], None]] = None
+
+
+def _last_seq(conn) -> int:
+    return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM appointment_changes").fetchone()[0]
+
+
+def _read_changes(conn, after_seq: int, limit: int) -> tuple[list[tuple], bool]:
+    # Второе значение — False, если часть журнала после after_seq уже удалена очисткой
+    rows = conn.execute(
+        f"SELECT seq, op, {CHANGE_COLUMNS} FROM appointment_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+        (after_seq, limit)
+    ).fetchall()
+    if not rows or rows[0][0] == after_seq + 1:
+        return rows, True
+    # Откат транзакции откатывает и счётчик AUTOINCREMENT, так что пропуск в номерах означает,
+    # что очистка дошла дальше after_seq; если старые строки ещё на месте, дельты целы
+    has_history = conn.execute("SELECT 1 FROM appointment_changes WHERE seq <= ? LIMIT 1", (after_seq,)).fetchone()
+    return rows, has_history is not None
+
+
+def _prune(conn, before: float) -> int:
+    with conn:
+        return conn.execute("DELETE FROM appointment_changes WHERE changed_at < ?", (before,)).rowcount
+
+
+def _to_change(row: tuple) -> Change:
+    return Change(row[0], row[1], db.Appointment(*row[2:]))
+
+
+class ChangeFeed:
+    # Каждый процесс дочитывает общий журнал сам и раздаёт дельты своим подписчикам (кешам, планировщику).
+    # Свои же изменения процесс тоже получает повторно, поэтому подписчики обязаны быть идемпотентными
+    def __init__(self, interval: float = CHANGEFEED_INTERVAL, batch_size: int = CHANGEFEED_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_seq: Optional[int] = None
+        self._subscribers: list[Subscriber] = []
+
+    def subscribe(self, on_changes: Callable[[list[Change]], None], on_reset: Optional[Callable[[], None]] = None):
+        self._subscribers.append(Subscriber(on_changes, on_reset))
+
+    async def changes_since(self, seq: int, limit: Optional[int] = None) -> list[Change]:
+        rows, _ = await db.database.run(_read_changes, seq, limit or self.batch_size)
+        return [_to_change(row) for row in rows]
+
+    def _dispatch(self, changes: list[Change]):
+        for subscriber in self._subscribers:
+            try:
+                subscriber.on_changes(changes)
+            except Exception as e:
+                print(f"❌ Change feed subscriber failed: {e}")
+                self._reset(subscriber)
+
+    def _reset(self, subscriber: Subscriber):
+        if subscriber.on_reset is not None:
+            subscriber.on_reset()
+
+    async def poll(self) -> int:
+        if self.last_seq is None:
+            # Начинаем с текущего конца: всё, что было раньше, подписчики и так прочитают из таблиц
+            self.last_seq = await db.database.run(_last_seq)
+            return 0
+        rows, contiguous = await db.database.run(_read_changes, self.last_seq, self.batch_size)
+        if not contiguous:
+            print(f"⚠️ Change feed fell behind retention after seq {self.last_seq}, resetting subscribers")
+            for subscriber in self._subscribers:
+                self._reset(subscriber)
+        if rows:
+            changes = [_to_change(row) for row in rows]
+            self.last_seq = changes[-1].seq
+            self._dispatch(changes)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                read = await self.poll()
+            except Exception as e:
+                print(f"❌ Failed to read the change feed: {e}")
+                read = 0
+            # Полная пачка — скорее всего, есть ещё: дочитываем без паузы
+            if read < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def prune(self, retention: float = CHANGEFEED_RETENTION) -> int:
+        return await db.database.run(_prune, time.time() - retention)
+
+    async def run_pruning(self):
+        while True:
+            try:
+                removed = await self.prune()
+                if removed:
+                    print(f"🧹 Pruned {removed} change feed entries")
+            except Exception as e:
+                print(f"❌ Failed to prune the change feed: {e}")
+            await asyncio.sleep(PRUNE_INTERVAL)
+
+
+feed = ChangeFeed()
+
+
+if __name__ == "__main__":
+    # python changefeed.py [after_seq] [path] — вывести изменения после указанного номера
+    after = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    connection = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else db.DB_PATH)
+    while True:
+        batch, _ = _read_changes(connection, after, CHANGEFEED_BATCH_SIZE)
+        for change in map(_to_change, batch):
+            a = change.appointment
+            print(f"{change.seq}\t{change.op}\t#{a.id}\t{a.date} {a.time}\tbarber {a.barber_id}\tuser {a.user_id}")
+        if len(batch) < CHANGEFEED_BATCH_SIZE:
+            break
+        after = batch[-1][0]
+    connection.close()
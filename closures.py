@@ -0,0 +1,164 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+from aiogram.types import Message
+
+import db
+import delivery
+from reminders import scheduler as reminder_scheduler
+from slot_cache import cache as slot_cache
+from user_summary import summaries
+
+WHOLE_DAY = ("00:00", "24:00")
+# Как часто обновляем у админа сообщение о ходе рассылки (чаще — упрёмся в лимит правок)
+PROGRESS_INTERVAL = 2.0
+
+# Слот закрыт админом. Подставляется в условные INSERT удержаний и записей,
+# параметры: date, barber_id, time, time
+SLOT_CLOSED_SQL = '''EXISTS (
+    SELECT 1 FROM closures c WHERE c.date = ? AND (c.barber_id IS NULL OR c.barber_id = ?)
+      AND c.start_time <= ? AND ? < c.end_time
+)'''
+# Записи и удержания, попадающие под закрытие: даты, часы и барбер (NULL — все кресла).
+# Уже прошедшие визиты не трогаем: отменять их и писать клиенту «запись отменена» поздно
+_SCOPE = (
+    "date BETWEEN ? AND ? AND time >= ? AND time < ? AND (? IS NULL OR barber_id = ?) AND (date, time) >= (?, ?)"
+)
+
+
+def _scope_params(
+    start_date: str, end_date: str, start_time: str, end_time: str, barber_id: Optional[int], now: float
+) -> tuple:
+    moment = datetime.fromtimestamp(now)
+    return (
+        start_date, end_date, start_time, end_time, barber_id, barber_id,
+        moment.strftime("%Y-%m-%d"), moment.strftime("%H:%M"),
+    )
+
+
+def _preview(
+    conn, start_date: str, end_date: str, start_time: str, end_time: str, barber_id: Optional[int], now: float
+) -> tuple[int, int]:
+    # Сколько записей отменится и скольких клиентов это коснётся
+    return conn.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT user_id) FROM appointments WHERE {_SCOPE}",
+        _scope_params(start_date, end_date, start_time, end_time, barber_id, now)
+    ).fetchone()
+
+
+def _close(
+    conn, dates: list[str], start_time: str, end_time: str, barber_id: Optional[int], reason: Optional[str], now: float
+) -> list[db.Appointment]:
+    # Одна транзакция: закрытие, отмена записей, снятие удержаний и листа ожидания
+    params = _scope_params(dates[0], dates[-1], start_time, end_time, barber_id, now)
+    with conn:
+        conn.executemany(
+            "INSERT INTO closures (date, start_time, end_time, barber_id, reason, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(date, start_time, end_time, barber_id, reason, now) for date in dates]
+        )
+        rows = conn.execute(
+            f"SELECT {db.APPOINTMENT_COLUMNS} FROM appointments WHERE {_SCOPE} ORDER BY date, time", params
+        ).fetchall()
+        conn.execute(f"DELETE FROM appointments WHERE {_SCOPE}", params)
+        conn.execute(f"DELETE FROM slot_holds WHERE {_SCOPE}", params)
+        if barber_id is None:
+            # Весь салон закрыт: ждать в эти часы нечего, а «любое время» — только если закрыт весь день
+            conn.execute('''
+                DELETE FROM waitlist WHERE date BETWEEN ? AND ?
+                  AND (time >= ? AND time < ? OR time IS NULL AND ? = ? AND ? = ?)
+            ''', (dates[0], dates[-1], start_time, end_time, start_time, WHOLE_DAY[0], end_time, WHOLE_DAY[1]))
+    return [db.Appointment(*row) for row in rows]
+
+
+def _reopen(conn, start_date: str, end_date: str) -> int:
+    with conn:
+        return conn.execute("DELETE FROM closures WHERE date BETWEEN ? AND ?", (start_date, end_date)).rowcount
+
+
+def _notification(appointments: list[db.Appointment], reason: Optional[str]) -> str:
+    slots = ", ".join(
+        f"{datetime.strptime(a.date, '%Y-%m-%d').strftime('%d.%m.%Y')} at {a.time}" for a in appointments
+    )
+    because = f" ({reason})" if reason else ""
+    noun = "appointment" if len(appointments) == 1 else "appointments"
+    verb = "has" if len(appointments) == 1 else "have"
+    return (
+        f"😔 Sorry, the barbershop is closed{because}, so your {noun} on {slots} {verb} been cancelled.\n"
+        f"Please choose another time: /start"
+    )
+
+
+class Closures:
+    def __init__(self, progress_interval: float = PROGRESS_INTERVAL):
+        self.progress_interval = progress_interval
+        # Рассылки идут в фоне, после ответа на нажатие; держим ссылки, чтобы задачи не собрал GC
+        self._notifications: set[asyncio.Task] = set()
+
+    async def preview(
+        self, start_date: str, end_date: str, start_time: str, end_time: str, barber_id: Optional[int]
+    ) -> tuple[int, int]:
+        return await db.database.run(_preview, start_date, end_date, start_time, end_time, barber_id, time.time())
+
+    async def close(
+        self, dates: list[str], start_time: str, end_time: str, barber_id: Optional[int], reason: Optional[str]
+    ) -> list[db.Appointment]:
+        cancelled = await db.database.run(_close, dates, start_time, end_time, barber_id, reason, time.time())
+        # Закрытия меняют маски сразу у многих дней — проще перечитать диапазон, чем править по слоту.
+        # Сброс после коммита: загрузка, успевшая прочитать закрытия до него, свой результат выбросит
+        slot_cache.clear()
+        for appointment in cancelled:
+            reminder_scheduler.cancel(appointment.id)
+            summaries.on_cancelled(appointment)
+        return cancelled
+
+    async def reopen(self, start_date: str, end_date: str) -> int:
+        removed = await db.database.run(_reopen, start_date, end_date)
+        slot_cache.clear()
+        return removed
+
+    async def notify(self, bot, cancelled: list[db.Appointment], reason: Optional[str], status: Message):
+        # Одно сообщение на клиента, даже если у него отменилось несколько записей
+        by_user: dict[int, list[db.Appointment]] = {}
+        for appointment in cancelled:
+            by_user.setdefault(appointment.user_id, []).append(appointment)
+        total = len(by_user)
+        done = 0
+
+        def on_progress(sent: int):
+            nonlocal done
+            done = sent
+
+        sending = asyncio.ensure_future(delivery.send_many(
+            bot, [(user_id, _notification(appointments, reason)) for user_id, appointments in by_user.items()],
+            on_progress=on_progress,
+        ))
+        shown = None
+        while True:
+            finished, _ = await asyncio.wait({sending}, timeout=self.progress_interval)
+            if finished:
+                break
+            text = f"📣 Notifying clients: {done}/{total}"
+            if text != shown:
+                await bot.edit_message_text(text, chat_id=status.chat.id, message_id=status.message_id)
+                shown = text
+
+        failed = sum(1 for error in sending.result() if error is not None)
+        failed_text = f", ❌ {failed} could not be reached" if failed else ""
+        await bot.edit_message_text(
+            f"✅ Notified {total - failed}/{total} clients{failed_text}", chat_id=status.chat.id, message_id=status.message_id
+        )
+
+    def start_notification(self, bot, cancelled: list[db.Appointment], reason: Optional[str], status: Message):
+        task = asyncio.ensure_future(self.notify(bot, cancelled, reason, status))
+        self._notifications.add(task)
+        task.add_done_callback(self._notification_done)
+
+    def _notification_done(self, task: asyncio.Task):
+        self._notifications.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Failed to notify clients about a closure: {task.exception()}")
+
+
+closures = Closures()
@@ -0,0 +1,352 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional, TypeVar
+
+import migrations
+
+DB_PATH = os.getenv("DB_PATH", "database.db")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+T = TypeVar("T")
+
+
+@dataclass
+class Appointment:
+    id: int
+    user_id: int
+    date: str
+    time: str
+    name: str
+    phone: str
+    reminded: int = 0
+    barber_id: int = 1
+
+
+APPOINTMENT_COLUMNS = "id, user_id, date, time, name, phone, reminded, barber_id"
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class Database:
+    # Каждый поток пула держит своё соединение, запросы уходят с event loop в эти потоки
+    def __init__(self, path: str = DB_PATH, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Хук для метрик: вызывается с именем запроса и временем выполнения в секундах
+        self.on_query: Optional[Callable[[str, float], None]] = None
+
+    def _init_worker(self):
+        conn = _connect(self.path)
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_size,
+                thread_name_prefix="db",
+                initializer=self._init_worker,
+            )
+        return self._executor
+
+    def _call(self, fn: Callable[..., T], args: tuple) -> T:
+        return fn(self._local.conn, *args)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        if self.on_query is None:
+            return await loop.run_in_executor(self._get_executor(), self._call, fn, args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._get_executor(), self._call, fn, args)
+        finally:
+            self.on_query(getattr(fn, "__name__", "query").lstrip("_"), time.perf_counter() - started)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+database = Database()
+
+
+def _row_to_appointment(row) -> Appointment:
+    return Appointment(*row)
+
+
+# --- schema ---
+
+async def init_db() -> int:
+    return await database.run(migrations.migrate)
+
+
+# --- appointments repository ---
+
+def _get_booked_slots_between(conn, start: str, end: str) -> list[tuple[str, str, int]]:
+    return conn.execute(
+        "SELECT date, time, barber_id FROM appointments WHERE date BETWEEN ? AND ?", (start, end)
+    ).fetchall()
+
+
+async def get_booked_slots_between(start: str, end: str) -> list[tuple[str, str, int]]:
+    return await database.run(_get_booked_slots_between, start, end)
+
+
+def _get_closures_between(conn, start: str, end: str) -> list[tuple[str, str, str, Optional[int]]]:
+    return conn.execute(
+        "SELECT date, start_time, end_time, barber_id FROM closures WHERE date BETWEEN ? AND ?", (start, end)
+    ).fetchall()
+
+
+async def get_closures_between(start: str, end: str) -> list[tuple[str, str, str, Optional[int]]]:
+    return await database.run(_get_closures_between, start, end)
+
+
+def _delete_appointments(conn, appointment_ids: list[int]) -> list[Appointment]:
+    # Все удаления одной транзакцией; возвращаем только реально удалённые записи
+    placeholders = ", ".join("?" * len(appointment_ids))
+    with conn:
+        rows = conn.execute(
+            f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE id IN ({placeholders})", appointment_ids
+        ).fetchall()
+        conn.execute(f"DELETE FROM appointments WHERE id IN ({placeholders})", appointment_ids)
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def delete_appointments(appointment_ids: list[int]) -> list[Appointment]:
+    if not appointment_ids:
+        return []
+    return await database.run(_delete_appointments, appointment_ids)
+
+
+async def delete_appointment(appointment_id: int) -> Optional[Appointment]:
+    deleted = await delete_appointments([appointment_id])
+    return deleted[0] if deleted else None
+
+
+def _get_appointments_by_ids(conn, appointment_ids: list[int]) -> list[Appointment]:
+    placeholders = ", ".join("?" * len(appointment_ids))
+    rows = conn.execute(
+        f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE id IN ({placeholders}) ORDER BY date, time",
+        appointment_ids
+    ).fetchall()
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def get_appointments_by_ids(appointment_ids: list[int]) -> list[Appointment]:
+    if not appointment_ids:
+        return []
+    return await database.run(_get_appointments_by_ids, appointment_ids)
+
+
+def _get_last_appointment(conn, user_id: int) -> Optional[Appointment]:
+    # Архив старше любой записи в рабочей таблице, поэтому туда смотрим, только если там пусто
+    for table in ("appointments", "appointment_history"):
+        row = conn.execute(
+            f"SELECT {APPOINTMENT_COLUMNS} FROM {table} WHERE user_id = ? ORDER BY date DESC, time DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        if row:
+            return _row_to_appointment(row)
+    return None
+
+
+def _get_user_history_page(
+    conn, user_id: int, cursor: Optional[tuple[str, str, int]], older: bool, limit: int
+) -> list[Appointment]:
+    # Страница истории от новых к старым; keyset по (date, time, id) идёт по индексу (user_id, date, time),
+    # т.к. rowid — неявный последний столбец индекса. Из каждой таблицы берём не больше limit строк
+    where, params = "user_id = ?", [user_id]
+    if cursor is not None:
+        where += " AND (date, time, id) < (?, ?, ?)" if older else " AND (date, time, id) > (?, ?, ?)"
+        params.extend(cursor)
+    order = "DESC" if older else "ASC"
+    rows = []
+    for table in ("appointment_history", "appointments"):
+        rows.extend(conn.execute(
+            f"SELECT {APPOINTMENT_COLUMNS} FROM {table} WHERE {where} "
+            f"ORDER BY date {order}, time {order}, id {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall())
+    rows.sort(key=lambda row: (row[2], row[3], row[0]), reverse=True)
+    rows = rows[:limit] if older else rows[-limit:]
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def get_user_history_page(
+    user_id: int, cursor: Optional[tuple[str, str, int]], older: bool, limit: int
+) -> list[Appointment]:
+    return await database.run(_get_user_history_page, user_id, cursor, older, limit)
+
+
+def _count_user_bookings_between(conn, user_id: int, start: str, end: str) -> int:
+    # Начало недели может быть уже в архиве
+    return conn.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM appointments WHERE user_id = ? AND date BETWEEN ? AND ?)
+          + (SELECT COUNT(*) FROM appointment_history WHERE user_id = ? AND date BETWEEN ? AND ?)
+    """, (user_id, start, end, user_id, start, end)).fetchone()[0]
+
+
+def _get_upcoming_for_user(conn, user_id: int, date: str, time: str) -> list[Appointment]:
+    rows = conn.execute(f"""
+        SELECT {APPOINTMENT_COLUMNS} FROM appointments
+        WHERE user_id = ? AND (
+            date > ? OR (date = ? AND time > ?)
+        )
+        ORDER BY date, time
+    """, (user_id, date, date, time)).fetchall()
+    return [_row_to_appointment(row) for row in rows]
+
+
+def _get_user_summary(
+    conn, user_id: int, today: str, week_start: str, week_end: str
+) -> tuple[Optional[Appointment], list[Appointment], int]:
+    # Всё, что нужно для меню пользователя, одним походом в пул
+    return (
+        _get_last_appointment(conn, user_id),
+        _get_upcoming_for_user(conn, user_id, today, ""),
+        _count_user_bookings_between(conn, user_id, week_start, week_end),
+    )
+
+
+async def get_user_summary(
+    user_id: int, today: str, week_start: str, week_end: str
+) -> tuple[Optional[Appointment], list[Appointment], int]:
+    return await database.run(_get_user_summary, user_id, today, week_start, week_end)
+
+
+def _get_appointments_page(
+    conn, date: Optional[str], cursor: Optional[tuple[str, str, int]], backwards: bool, limit: int
+) -> list[Appointment]:
+    # Keyset-пагинация по (date, time, barber_id) — это ключ уникального индекса слота.
+    # Страницу берём из обеих таблиц по индексу и сливаем: не больше 2 * limit строк
+    conditions, params = [], []
+    if date is not None:
+        conditions.append("date = ?")
+        params.append(date)
+    if cursor is not None:
+        conditions.append(
+            "(date, time, barber_id) < (?, ?, ?)" if backwards else "(date, time, barber_id) > (?, ?, ?)"
+        )
+        params.extend(cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "DESC" if backwards else "ASC"
+    rows = []
+    for table in ("appointment_history", "appointments"):
+        rows.extend(conn.execute(
+            f"SELECT {APPOINTMENT_COLUMNS} FROM {table} {where} "
+            f"ORDER BY date {order}, time {order}, barber_id {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall())
+    rows.sort(key=lambda row: (row[2], row[3], row[7]))
+    rows = rows[-limit:] if backwards else rows[:limit]
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def get_appointments_page(
+    date: Optional[str], cursor: Optional[tuple[str, str, int]], backwards: bool, limit: int
+) -> list[Appointment]:
+    return await database.run(_get_appointments_page, date, cursor, backwards, limit)
+
+
+def _get_appointments_chunk(
+    conn, start: str, end: str, cursor: Optional[tuple[str, str, int]], limit: int
+) -> list[Appointment]:
+    # Очередной кусок выгрузки за [start, end] из обеих таблиц, keyset по (date, time, barber_id)
+    where, params = "date BETWEEN ? AND ?", [start, end]
+    if cursor is not None:
+        where += " AND (date, time, barber_id) > (?, ?, ?)"
+        params.extend(cursor)
+    rows = []
+    for table in ("appointment_history", "appointments"):
+        rows.extend(conn.execute(
+            f"SELECT {APPOINTMENT_COLUMNS} FROM {table} WHERE {where} ORDER BY date, time, barber_id LIMIT ?",
+            (*params, limit)
+        ).fetchall())
+    rows.sort(key=lambda row: (row[2], row[3], row[7]))
+    return [_row_to_appointment(row) for row in rows[:limit]]
+
+
+async def get_appointments_chunk(
+    start: str, end: str, cursor: Optional[tuple[str, str, int]], limit: int
+) -> list[Appointment]:
+    return await database.run(_get_appointments_chunk, start, end, cursor, limit)
+
+
+def _get_appointments_on_date(conn, date: str) -> list[Appointment]:
+    rows = conn.execute(
+        f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE date = ? ORDER BY time", (date,)
+    ).fetchall()
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def get_appointments_on_date(date: str) -> list[Appointment]:
+    return await database.run(_get_appointments_on_date, date)
+
+
+def _get_upcoming_unreminded(conn, date: str) -> list[Appointment]:
+    rows = conn.execute(
+        f"SELECT {APPOINTMENT_COLUMNS} FROM appointments WHERE reminded = 0 AND date >= ? ORDER BY date, time",
+        (date,)
+    ).fetchall()
+    return [_row_to_appointment(row) for row in rows]
+
+
+async def get_upcoming_unreminded(date: str) -> list[Appointment]:
+    return await database.run(_get_upcoming_unreminded, date)
+
+
+def _mark_reminded_many(conn, appointment_ids: list[int]):
+    # Одна транзакция на всю пачку вместо commit на каждую строку
+    with conn:
+        conn.executemany("UPDATE appointments SET reminded = 1 WHERE id = ?", [(i,) for i in appointment_ids])
+
+
+async def mark_reminded_many(appointment_ids: list[int]):
+    if appointment_ids:
+        await database.run(_mark_reminded_many, appointment_ids)
+
+
+# --- archive ---
+
+def _archive_batch(conn, before_date: str, limit: int, now: float) -> int:
+    # Одна короткая транзакция на пачку: копируем в архив и удаляем из рабочей таблицы
+    with conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM appointments WHERE date < ? ORDER BY date, time LIMIT ?", (before_date, limit)
+        )]
+        if not ids:
+            return 0
+        placeholders = ", ".join("?" * len(ids))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO appointment_history ({APPOINTMENT_COLUMNS}, month, archived_at)
+            SELECT {APPOINTMENT_COLUMNS}, substr(date, 1, 7), ? FROM appointments WHERE id IN ({placeholders})
+        """, (now, *ids))
+        conn.execute(f"DELETE FROM appointments WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+async def archive_batch(before_date: str, limit: int) -> int:
+    return await database.run(_archive_batch, before_date, limit, time.time())
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 сообщение в секунду в один чат
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+CONCURRENCY = 20
+# Ведра чатов, которые давно не использовались, удаляем, чтобы словарь не рос бесконечно
+IDLE_BUCKET_TTL = 300
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        # Неблокирующий вариант: токен есть — берём, нет — сразу отказ
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    def __init__(self, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE):
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            now = time.monotonic()
+            if len(self._chats) > 1000:
+                self._chats = {
+                    cid: b for cid, b in self._chats.items()
+                    if now - b.updated < IDLE_BUCKET_TTL or b._lock.locked()
+                }
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        # Сначала ждём очередь своего чата, потом общий лимит бота
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+
+
+limiter = RateLimiter()
+
+
+def is_permanent(error: Optional[Exception]) -> bool:
+    # Пользователь заблокировал бота или чат не существует — повторять бессмысленно
+    return isinstance(error, (TelegramForbiddenError, TelegramBadRequest))
+
+
+async def send_message(bot, chat_id: int, text: str, **kwargs) -> Optional[Exception]:
+    # Возвращает None при успехе, иначе ошибку. Повторы на 429 делает очередь исходящих вызовов (outbox),
+    # здесь только соблюдаем лимиты и отдаём итоговую ошибку вызывающему: он решает, пробовать ли позже
+    await limiter.acquire(chat_id)
+    try:
+        await bot.send_message(chat_id, text, **kwargs)
+    except Exception as e:
+        return e
+    return None
+
+
+async def send_many(
+    bot, messages: list[tuple], concurrency: int = CONCURRENCY, on_progress: Optional[Callable[[int], None]] = None
+) -> list[Optional[Exception]]:
+    # Элемент — (chat_id, text) или (chat_id, text, {параметры send_message, например reply_markup}).
+    # on_progress получает число уже обработанных сообщений (доставленных или окончательно не доставленных)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def send_one(chat_id: int, text: str, options: Optional[dict] = None) -> Optional[Exception]:
+        nonlocal done
+        async with semaphore:
+            error = await send_message(bot, chat_id, text, **(options or {}))
+        done += 1
+        if on_progress is not None:
+            on_progress(done)
+        return error
+
+    return await asyncio.gather(*(send_one(*message) for message in messages))
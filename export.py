@@ -0,0 +1,89 @@
+import asyncio
+import csv
+import os
+import tempfile
+from typing import AsyncIterator, Optional
+
+import db
+from schedule import schedule
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX необязателен: без openpyxl доступна только выгрузка в CSV
+    Workbook = None
+
+# Сколько строк за один запрос к базе; в памяти одновременно живёт только один такой кусок
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+COLUMNS = ["id", "date", "time", "barber", "name", "phone", "user_id"]
+FIRST_DATE = "0001-01-01"
+LAST_DATE = "9999-12-31"
+
+
+def available_formats() -> list[str]:
+    return ["csv", "xlsx"] if Workbook is not None else ["csv"]
+
+
+async def iter_appointments(
+    start: str, end: str, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> AsyncIterator[list[db.Appointment]]:
+    cursor: Optional[tuple[str, str, int]] = None
+    while True:
+        rows = await db.get_appointments_chunk(start, end, cursor, chunk_size)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        cursor = (last.date, last.time, last.barber_id)
+
+
+def _row(appointment: db.Appointment) -> list:
+    return [
+        appointment.id, appointment.date, appointment.time, schedule.barber_name(appointment.barber_id),
+        appointment.name, appointment.phone, appointment.user_id,
+    ]
+
+
+async def _write_csv(path: str, start: str, end: str, chunk_size: int) -> int:
+    count = 0
+    # utf-8-sig — чтобы Excel сам узнал кодировку
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        async for chunk in iter_appointments(start, end, chunk_size):
+            writer.writerows(_row(appointment) for appointment in chunk)
+            count += len(chunk)
+    return count
+
+
+async def _write_xlsx(path: str, start: str, end: str, chunk_size: int) -> int:
+    # write_only: строки сразу уходят во временный файл openpyxl, а не копятся в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("bookings")
+    sheet.append(COLUMNS)
+    count = 0
+    async for chunk in iter_appointments(start, end, chunk_size):
+        for appointment in chunk:
+            sheet.append(_row(appointment))
+        count += len(chunk)
+    await asyncio.to_thread(workbook.save, path)
+    return count
+
+
+async def export_appointments(
+    fmt: str, start: str = FIRST_DATE, end: str = LAST_DATE, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> tuple[str, int]:
+    # Возвращает путь к временному файлу и число строк; удалить файл должен вызывающий
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    fd, path = tempfile.mkstemp(prefix="bookings-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        if fmt == "xlsx":
+            count = await _write_xlsx(path, start, end, chunk_size)
+        else:
+            count = await _write_csv(path, start, end, chunk_size)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
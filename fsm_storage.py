@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DEFAULT_DESTINY, StateType, StorageKey
+
+import db
+
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Как часто сбрасываем накопленные изменения в базу; 0 — писать сразу (нужно при нескольких процессах)
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+# Брошенные на полпути сценарии записи удаляем через сутки
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 60 * 60)))
+SWEEP_INTERVAL = 10 * 60
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: str, updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+def _key(key: StorageKey) -> str:
+    # Компактный ключ "bot:chat:user"; редкие поля добавляем только если они заданы
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id is not None or key.business_connection_id is not None or key.destiny != DEFAULT_DESTINY:
+        parts += [str(key.thread_id or ""), key.business_connection_id or "", key.destiny]
+    return ":".join(parts)
+
+
+def _load_entry(conn, key: str) -> Optional[tuple]:
+    return conn.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)).fetchone()
+
+
+def _flush(conn, upserts: list[tuple], deletes: list[tuple], expired_before: Optional[float]):
+    with conn:
+        if upserts:
+            conn.executemany('''
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', upserts)
+        if deletes:
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+        if expired_before is not None:
+            conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (expired_before,))
+
+
+class SQLiteStorage(BaseStorage):
+    # Горячий LRU в памяти + отложенная пачечная запись в таблицу fsm_states
+    def __init__(
+        self,
+        cache_size: int = FSM_CACHE_SIZE,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        ttl: float = FSM_TTL,
+    ):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._cache: OrderedDict[str, _Entry] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.updated_at > self.ttl
+
+    async def _get_entry(self, key: StorageKey) -> Optional[_Entry]:
+        k = _key(key)
+        now = time.time()
+        entry = self._cache.get(k)
+        if entry is None:
+            row = await db.database.run(_load_entry, k)
+            if row is None:
+                return None
+            entry = _Entry(row[0], row[1], row[2])
+            self._remember(k, entry)
+        else:
+            self._cache.move_to_end(k)
+        if self._expired(entry, now):
+            return None
+        return entry
+
+    def _remember(self, k: str, entry: _Entry):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        # Выселяем самые старые записи, но только уже сохранённые в базе
+        if len(self._cache) > self.cache_size:
+            for old_key in list(self._cache):
+                if len(self._cache) <= self.cache_size:
+                    break
+                if old_key not in self._dirty:
+                    del self._cache[old_key]
+
+    async def _put(self, key: StorageKey, state: Optional[str], data: str):
+        k = _key(key)
+        self._remember(k, _Entry(state, data, time.time()))
+        self._dirty.add(k)
+        if self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Пока идёт запись, _put новую задачу не ставит — поэтому крутимся, пока есть грязные ключи.
+        # Не записалось — ключи уже вернулись в _dirty, пробуем снова через тот же интервал
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush FSM state: {e}")
+            if not self._dirty:
+                return
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for k in dirty:
+            entry = self._cache.get(k)
+            if entry is None:
+                continue
+            if entry.state is None and entry.data == "{}":
+                deletes.append((k,))
+            else:
+                upserts.append((k, entry.state, entry.data, entry.updated_at))
+
+        now = time.time()
+        expired_before = None
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            expired_before = now - self.ttl
+            self._last_sweep = now
+
+        if upserts or deletes or expired_before is not None:
+            try:
+                await db.database.run(_flush, upserts, deletes, expired_before)
+            except Exception:
+                # Не потеряем изменения: вернём ключи в очередь на следующую запись
+                self._dirty |= dirty
+                raise
+        if self.cache_size <= 0:
+            self._cache.clear()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._get_entry(key)
+        state = state.state if isinstance(state, State) else state
+        await self._put(key, state, entry.data if entry else "{}")
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get_entry(key)
+        return entry.state if entry else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._get_entry(key)
+        await self._put(key, entry.state if entry else None, json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        entry = await self._get_entry(key)
+        return json.loads(entry.data) if entry else {}
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Coroutine
+
+import db
+
+# Лидер продлевает аренду каждые LEADER_RENEW_INTERVAL секунд; если он умер, через LEADER_LEASE_TTL
+# аренду забирает другой процесс
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", "5"))
+LEASE_NAME = "background-jobs"
+
+
+def _acquire(conn, name: str, holder: str, now: float, ttl: float) -> bool:
+    with conn:
+        cur = conn.execute('''
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        ''', (name, holder, now + ttl, now))
+        return cur.rowcount == 1
+
+
+def _release(conn, name: str, holder: str):
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+class LeaderElection:
+    # Фоновые задачи (напоминания, архив, чистка удержаний) запускает только владелец аренды в базе.
+    # Потерял аренду — задачи останавливаются, при штатной остановке аренда отдаётся сразу
+    def __init__(self, name: str = LEASE_NAME, ttl: float = LEADER_LEASE_TTL, interval: float = LEADER_RENEW_INTERVAL):
+        if interval >= ttl:
+            raise ValueError("Lease must be renewed more often than it expires")
+        self.name = name
+        self.ttl = ttl
+        self.interval = interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._tasks: list[asyncio.Task] = []
+
+    async def _try_acquire(self) -> bool:
+        try:
+            return await db.database.run(_acquire, self.name, self.holder, time.time(), self.ttl)
+        except Exception as e:
+            # Не смогли продлить — считаем, что аренды нет: лучше пропустить цикл задач, чем запустить их дважды
+            print(f"❌ Failed to renew leader lease: {e}")
+            return False
+
+    async def _stop_jobs(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _restart_failed(self, jobs: Callable[[], list[Coroutine]]):
+        # Упавшая задача не должна тихо пропасть, пока процесс держит аренду: перезапускаем её на следующем
+        # продлении. Задача, которая просто завершилась (например, выключенный бэкап), так и остаётся завершённой
+        failed = {
+            index for index, task in enumerate(self._tasks)
+            if task.done() and not task.cancelled() and task.exception() is not None
+        }
+        if not failed:
+            return
+        for index, job in enumerate(jobs()):
+            if index not in failed:
+                job.close()
+                continue
+            print(f"❌ Background job {job.__qualname__} failed: {self._tasks[index].exception()!r}, restarting")
+            self._tasks[index] = asyncio.ensure_future(job)
+
+    async def run(self, jobs: Callable[[], list[Coroutine]]):
+        # jobs вызывается при каждом получении лидерства и перезапуске упавшей задачи, возвращает свежие корутины
+        try:
+            while True:
+                acquired = await self._try_acquire()
+                if acquired and not self.is_leader:
+                    print(f"👑 {self.holder} is now running background jobs")
+                    self._tasks = [asyncio.ensure_future(job) for job in jobs()]
+                elif not acquired and self.is_leader:
+                    print(f"⚠️ {self.holder} lost the leader lease, stopping background jobs")
+                    await self._stop_jobs()
+                elif acquired:
+                    self._restart_failed(jobs)
+                self.is_leader = acquired
+                await asyncio.sleep(self.interval)
+        finally:
+            await self._stop_jobs()
+            if self.is_leader:
+                self.is_leader = False
+                await db.database.run(_release, self.name, self.holder)
+
+
+election = LeaderElection()
@@ -8,34 +8,41 @@ from datetime import datetime, timedelta
 import asyncio
 import os
 from dotenv import load_dotenv
-import sqlite3
+import db
+import metrics
+import outbox
+import throttling
+import webhook
+from callbacks import (
+    CallbackRouter, StartBooking, PickDate, PickTime, Confirm, HistoryPage, AskCancel, ConfirmCancel, CancelBack,
+    JoinWaitlist, ClaimOffer,
+    pack_date, unpack_date, pack_time, unpack_time, pack_stamp, unpack_stamp,
+)
+from fsm_storage import SQLiteStorage
+from slot_cache import cache as slot_cache
+from schedule import schedule, minutes_of, horizon_end
+from reminders import scheduler as reminder_scheduler
+from reservations import reservations
+from archive import archiver
+from backup import backup_job
+from changefeed import feed as change_feed
+from leader import election
+from user_summary import summaries
+from waitlist import waitlist, WAITLIST_MAX_PER_USER
 from admin import router as admin_router
 
-conn = sqlite3.connect("database.db")
-cursor = conn.cursor()
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS appointments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        time TEXT NOT NULL,
-        name TEXT NOT NULL,
-        phone TEXT NOT NULL,
-        reminded INTEGER DEFAULT 0
-    )
-''')
-conn.commit()
-
 
 load_dotenv()
 API_TOKEN = os.getenv("BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling, webhook или worker (процесс под supervisor.py)
 
 if not API_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения")
 
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=SQLiteStorage())
+callback_router = CallbackRouter()
+callback_router.setup(dp)
 
 class BookingStates(StatesGroup):
     START_MENU = State()
@@ -60,88 +67,124 @@ M_menu.button(text="❌ Cancel my appointment")
 M_menu.adjust(1)
 
 
-def get_date_keyboard():
-    today = datetime.now().date()
-    now_time = datetime.now().time()
-    buttons = []
-    all_times = ["10:00", "11:00", "12:00", "13:00", "14:00", "15:00", "16:00", "17:00", "18:00"]
+async def get_busy_masks(date_str, user_id=None):
+    # Занятые записью слоты плюс удержанные другими пользователями и закрытые админом, по каждому барберу
+    busy = dict(await slot_cache.busy_masks(date_str))
+    for masks in (await reservations.held_masks(date_str, user_id), await slot_cache.closed_masks(date_str)):
+        for barber_id, mask in masks.items():
+            busy[barber_id] = busy.get(barber_id, 0) | mask
+    return busy
 
-    valid_days_found = 0
-    current_day = today
 
-    while valid_days_found < 7:
-        if current_day.weekday() < 6:  # Понедельник–Суббота
-            booked_times = get_booked_times(current_day.strftime('%Y-%m-%d'))
+async def is_open_day(day):
+    closed = await slot_cache.closed_masks(day)
+    return not closed or any(schedule.free_masks(day, closed).values())
 
-            available_times = []
-            for t in all_times:
-                if t in booked_times:
-                    continue
 
-                if current_day == today:
-                    slot_time = datetime.strptime(t, "%H:%M").time()
-                    if slot_time <= now_time:
-                        continue
+async def get_date_keyboard(user_id=None):
+    now = datetime.now()
+    today = now.date()
+    buttons = []
 
-                available_times.append(t)
+    valid_days_found = 0
+    full_days_found = 0
+    current_day = today
 
-            if available_times:
-                slots_count = len(available_times)
+    # Дальше горизонта записи не ищем, чтобы пустое расписание не зациклило поиск
+    while valid_days_found < 7 and current_day <= horizon_end(today):
+        date_str = current_day.strftime('%Y-%m-%d')
+        # Закрытый админом день не показываем вовсе — ни со временем, ни как занятый с листом ожидания
+        if schedule.is_working_day(current_day) and await is_open_day(current_day):
+            available = schedule.available_mask(current_day, await get_busy_masks(date_str, user_id))
+            if current_day == today:
+                available &= schedule.after_mask(minutes_of(now))
+
+            slots_count = available.bit_count()
+            if slots_count:
                 if slots_count == 1:
                     label = f"{current_day.strftime('%d.%m.%Y')} (1 time left)"
                 else:
                     label = f"{current_day.strftime('%d.%m.%Y')} ({slots_count} times left)"
                 
-                callback = f"date:{current_day.strftime('%Y-%m-%d')}"
+                callback = PickDate(day=pack_date(date_str)).pack()
                 buttons.append([InlineKeyboardButton(text=label, callback_data=callback)])
                 valid_days_found += 1
+            elif current_day != today and full_days_found < 7:
+                # Полностью занятый день не прячем: вместо повторных заходов предлагаем лист ожидания
+                label = f"🔔 {current_day.strftime('%d.%m.%Y')} (fully booked, join waitlist)"
+                buttons.append([InlineKeyboardButton(text=label, callback_data=waitlist_button(date_str))])
+                full_days_found += 1
 
         current_day += timedelta(days=1)
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_time_keyboard(selected_date):
-    all_times = ["10:00", "11:00", "12:00", "13:00", "14:00", "15:00", "16:00", "17:00", "18:00"]
-    booked = get_booked_times(selected_date.strftime('%Y-%m-%d'))
+def bookable_date(date_str):
+    # Дата из callback data: кнопки можно подделать, поэтому проверяем формат и горизонт записи
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    today = datetime.now().date()
+    return day if today <= day <= horizon_end(today) else None
+
+
+async def get_time_keyboard(selected_date, user_id=None):
+    date_str = selected_date.strftime('%Y-%m-%d')
+    available = schedule.available_mask(selected_date, await get_busy_masks(date_str, user_id))
 
     now = datetime.now()
-    today = now.date()
-    current_time = now.time()
+    # ⛔ skip past times and times less than 1 hour from now
+    if selected_date == now.date():
+        available &= schedule.after_mask(minutes_of(now) + 60)
 
-    buttons = []
-    for t in all_times:
-        time_obj = datetime.strptime(t, "%H:%M").time()
+    buttons = [
+        [InlineKeyboardButton(text=t, callback_data=PickTime(time=pack_time(t)).pack())]
+        for t in schedule.times(available)
+    ]
 
-        # ⛔ skip booked times
-        if t in booked:
-            continue
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-        # ⛔ skip past times and times less than 1 hour from now
-        if selected_date == today and datetime.combine(today, time_obj) <= now + timedelta(hours=1):
-            continue
 
-        # ✅ add button
-        buttons.append([InlineKeyboardButton(text=t, callback_data=f"time:{t}")])
+def waitlist_button(date_str, time_str=None):
+    return JoinWaitlist(day=pack_date(date_str), time=pack_time(time_str) if time_str else None).pack()
 
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def get_time_keyboard_with_waitlist(selected_date, time_str, user_id=None):
+    # Выбранное время только что заняли — кроме других времён предлагаем подождать именно его
+    markup = await get_time_keyboard(selected_date, user_id)
+    markup.inline_keyboard.append([InlineKeyboardButton(
+        text=f"🔔 Notify me if {time_str} frees up",
+        callback_data=waitlist_button(selected_date.strftime('%Y-%m-%d'), time_str)
+    )])
+    return markup
 
 
 def get_confirmation_keyboard():
     buttons = [
-        [InlineKeyboardButton(text="✅ Yes", callback_data="confirm:yes")],
-        [InlineKeyboardButton(text="🔁 Change", callback_data="confirm:change")]
+        [InlineKeyboardButton(text="✅ Yes", callback_data=Confirm(yes=True).pack())],
+        [InlineKeyboardButton(text="🔁 Change", callback_data=Confirm(yes=False).pack())]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+async def release_hold(user_id, state):
+    # Пользователь ушёл со слота, который держал, — освобождаем его сразу, а не через HOLD_TTL
+    if (await state.get_data()).get("barber_id") is not None:
+        await reservations.release(user_id)
+        await state.update_data(barber_id=None)
+
+
 @dp.message(Command("start"))
 async def start_cmd(message: Message, state: FSMContext):
     await state.set_state(BookingStates.START_MENU)
+    # После set_state данные FSM уже в кеше хранилища — проверка удержания не идёт лишний раз в базу
+    await release_hold(message.from_user.id, state)
 
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="📩 Send a Request", callback_data="send_request")]
+            [InlineKeyboardButton(text="📩 Send a Request", callback_data=StartBooking().pack())]
         ]
     )
 
@@ -151,25 +194,28 @@ async def start_cmd(message: Message, state: FSMContext):
     )
 
 # add send request validation
-@dp.callback_query(F.data == "send_request")
+@callback_router(StartBooking)
 async def handle_send_request(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()  # ❗ Убираем inline-кнопку из старого сообщения
     await callback.message.answer(
         "Please select a date for your appointment:",
-        reply_markup=get_date_keyboard()
+        reply_markup=await get_date_keyboard(callback.from_user.id)
     )
     await state.set_state(BookingStates.WAITING_FOR_DATE)
     await callback.answer()
 
 
 # add date validation
-@dp.callback_query(F.data.startswith("date:"))
-async def process_date(callback: types.CallbackQuery, state: FSMContext):
+@callback_router(PickDate)
+async def process_date(callback: types.CallbackQuery, callback_data: PickDate, state: FSMContext):
+    date_str = unpack_date(callback_data.day)
+    date = bookable_date(date_str)
+    if date is None:
+        await callback.answer("⚠️ This date is not available for booking.", show_alert=True)
+        return
     await callback.message.edit_reply_markup()  # Убираем inline-кнопки
-    date_str = callback.data.split(":")[1]
-    date = datetime.strptime(date_str, "%Y-%m-%d").date()
 
-    await state.update_data(date=date, target="date")
+    await state.update_data(date=date_str, target="date")
     await callback.message.answer(
         f"You selected the date: {date.strftime('%d.%m.%Y')}\nIs it correct?",
         reply_markup=get_confirmation_keyboard()
@@ -177,13 +223,12 @@ async def process_date(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(BookingStates.WAITING_FOR_CONFIRMATION)
 
 # add time validation
-@dp.callback_query(F.data.startswith("time:"))
-async def process_time(callback: types.CallbackQuery, state: FSMContext):
+@callback_router(PickTime)
+async def process_time(callback: types.CallbackQuery, callback_data: PickTime, state: FSMContext):
     await callback.message.edit_reply_markup()  # Убираем inline-кнопки
-    time_str = callback.data.removeprefix("time:")
-    time = datetime.strptime(time_str, "%H:%M").time()
+    time_str = unpack_time(callback_data.time)
 
-    await state.update_data(time=time, target="time")
+    await state.update_data(time=time_str, target="time")
     await callback.message.answer(f"You selected the time: {time_str}\nIs it correct?", reply_markup=get_confirmation_keyboard())
     await state.set_state(BookingStates.WAITING_FOR_CONFIRMATION)
 
@@ -219,20 +264,36 @@ async def process_phone(message: Message, state:FSMContext):
 
 
 # add confirmation 
-@dp.callback_query(F.data.startswith("confirm:"))
-async def process_date_confirmation(callback: types.CallbackQuery, state: FSMContext):
+@callback_router(Confirm)
+async def process_date_confirmation(callback: types.CallbackQuery, callback_data: Confirm, state: FSMContext):
     await callback.message.edit_reply_markup()  # Убираем inline-кнопки
-    answer = callback.data.split(":")[1]
+    answer = "yes" if callback_data.yes else "change"
     data = await state.get_data()
     target = data.get("target")
 
     if answer == "yes":
         if target == "date":
-            selected_date = data.get("date")  # ← достаём дату из FSM
-            await callback.message.answer("Now choose a time:", reply_markup=get_time_keyboard(selected_date))
+            selected_date = datetime.strptime(data.get("date"), "%Y-%m-%d").date()  # ← достаём дату из FSM
+            await callback.message.answer("Now choose a time:", reply_markup=await get_time_keyboard(selected_date, callback.from_user.id))
             await state.set_state(BookingStates.WAITING_FOR_TIME)
             
         elif target == "time":
+            # Держим слот за первым свободным барбером, пока пользователь вводит имя и телефон
+            selected_date = datetime.strptime(data.get("date"), "%Y-%m-%d").date()
+            busy = await get_busy_masks(data.get("date"), callback.from_user.id)
+            barber_id = await reservations.hold(
+                data.get("date"), data.get("time"), callback.from_user.id,
+                schedule.barbers_free_at(selected_date, data.get("time"), busy)
+            )
+            if barber_id is None:
+                await callback.message.answer(
+                    "⚠️ Sorry, someone else is booking this time right now.\nPlease choose another time:",
+                    reply_markup=await get_time_keyboard_with_waitlist(selected_date, data.get("time"), callback.from_user.id)
+                )
+                await state.set_state(BookingStates.WAITING_FOR_TIME)
+                await callback.answer()
+                return
+            await state.update_data(barber_id=barber_id)
             await callback.message.answer("Please enter your name:")
             await state.set_state(BookingStates.WAITING_FOR_NAME)
 
@@ -242,25 +303,46 @@ async def process_date_confirmation(callback: types.CallbackQuery, state: FSMCon
 
         elif target == "phone":
             data = await state.get_data()
-            date = data.get("date")
-            time = data.get("time")
+            # В FSM храним компактные строки, объекты собираем только здесь
+            date = datetime.strptime(data.get("date"), "%Y-%m-%d").date()
+            time = datetime.strptime(data.get("time"), "%H:%M").time()
             name = data.get("name")
             phone = data.get("phone")
+            barber_id = data.get("barber_id", 1)
 
+            # Барбера показываем, только если в расписании их несколько
+            barber_line = f"💈 Barber: {schedule.barber_name(barber_id)}\n" if len(schedule.barbers) > 1 else ""
             confirmation_text = (
                 f"✅ Your appointment is confirmed!\n\n"
                 f"📅 Date: {date.strftime('%d.%m.%Y')}\n"
                 f"⏰ Time: {time.strftime('%H:%M')}\n"
+                f"{barber_line}"
                 f"👤 Name: {name}\n"
                 f"📞 Phone: {phone}"
             )
 
-            cursor.execute(
-                "INSERT INTO appointments (user_id, date, time, name, phone) VALUES (?, ?, ?, ?, ?)",
-                (callback.from_user.id, date.strftime('%Y-%m-%d'), time.strftime('%H:%M'), name, phone)
+            appointment_id = await reservations.book(
+                callback.from_user.id, date.strftime('%Y-%m-%d'), time.strftime('%H:%M'), barber_id, name, phone
             )
-            conn.commit()
 
+            if appointment_id is None:
+                # ⛔ кто-то успел занять этот слот раньше
+                await state.update_data(target="time")
+                await callback.message.answer(
+                    "⚠️ Sorry, this time has just been booked by someone else.\nPlease choose another time:",
+                    reply_markup=await get_time_keyboard_with_waitlist(date, time.strftime('%H:%M'), callback.from_user.id)
+                )
+                await state.set_state(BookingStates.WAITING_FOR_TIME)
+                await callback.answer()
+                return
+
+            appointment = db.Appointment(
+                appointment_id, callback.from_user.id, date.strftime('%Y-%m-%d'), time.strftime('%H:%M'), name, phone,
+                barber_id=barber_id
+            )
+            slot_cache.mark_booked(date, time.strftime('%H:%M'), barber_id)
+            reminder_scheduler.push(appointment)
+            summaries.on_booked(appointment)
             await callback.message.answer(confirmation_text)
             await callback.message.answer(
                 "What would you like to do next?",
@@ -271,13 +353,16 @@ async def process_date_confirmation(callback: types.CallbackQuery, state: FSMCon
             
 
     elif answer == "change":
+        if target in ("date", "time"):
+            await release_hold(callback.from_user.id, state)
+
         if target == "date":
-            await callback.message.answer("Please select a date again:", reply_markup=get_date_keyboard())
+            await callback.message.answer("Please select a date again:", reply_markup=await get_date_keyboard(callback.from_user.id))
             await state.set_state(BookingStates.WAITING_FOR_DATE)
 
         elif target == "time":
-            selected_date = data.get("date")
-            await callback.message.answer("Please choose a time again:", reply_markup=get_time_keyboard(selected_date))
+            selected_date = datetime.strptime(data.get("date"), "%Y-%m-%d").date()
+            await callback.message.answer("Please choose a time again:", reply_markup=await get_time_keyboard(selected_date, callback.from_user.id))
             await state.set_state(BookingStates.WAITING_FOR_TIME)
 
         elif target == "name":
@@ -291,54 +376,82 @@ async def process_date_confirmation(callback: types.CallbackQuery, state: FSMCon
 
     await callback.answer()
 
-def get_booked_times(date):
-    cursor.execute("SELECT time FROM appointments WHERE date = ?", (date,))
-    results = cursor.fetchall()
-    return [row[0] for row in results]
-
 @dp.message(BookingStates.MAIN_MENU, F.text == "📋 View my last appointment")
 async def show_last_appointment(message: Message, state: FSMContext):
     await message.answer("Your last appointment:")
-    cursor.execute("SELECT * FROM appointments WHERE user_id = ? ORDER BY date DESC, time DESC LIMIT 1", (message.from_user.id,))
-    result = cursor.fetchone()
+    result = (await summaries.get(message.from_user.id)).last
     if result:
-        await message.answer(f"Date: {result[2]}\nTime: {result[3]}\nName: {result[4]}\nPhone: {result[5]}")
+        await message.answer(f"Date: {result.date}\nTime: {result.time}\nName: {result.name}\nPhone: {result.phone}")
     else:
         await message.answer("You have no appointments yet.")
     await state.set_state(BookingStates.MAIN_MENU)
 
+HISTORY_PAGE_SIZE = 10
+
+
+def _history_button(older: bool, appointment) -> str:
+    return HistoryPage(older=older, stamp=pack_stamp(appointment.date, appointment.time), id=appointment.id).pack()
+
+
+async def get_history_page(user_id: int, older: bool = True, cursor: tuple[str, str, int] = None):
+    # Страницы от новых записей к старым; older — листаем к более старым записям
+    rows = await db.get_user_history_page(user_id, cursor, older, HISTORY_PAGE_SIZE + 1)
+
+    # Лишняя строка показывает, есть ли ещё записи в направлении листания
+    has_more = len(rows) > HISTORY_PAGE_SIZE
+    if has_more:
+        rows = rows[:-1] if older else rows[1:]
+    has_newer = has_more if not older else cursor is not None
+    has_older = has_more if older else True
+
+    if not rows:
+        return None, None
+
+    text_lines = [f"{row.date}, {row.time}, {row.name}" for row in rows]
+    text = "🗂 Your booking history:\n\n" + "\n".join(text_lines)
+
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton(text="⬅️ Newer", callback_data=_history_button(False, rows[0])))
+    if has_older:
+        nav.append(InlineKeyboardButton(text="Older ➡️", callback_data=_history_button(True, rows[-1])))
+    markup = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return text, markup
+
+
 @dp.message(BookingStates.MAIN_MENU, F.text == "📜 View booking history")
 async def show_booking_history(message: Message, state: FSMContext):
-    cursor.execute("SELECT date, time, name FROM appointments WHERE user_id = ? ORDER BY date, time", (message.from_user.id,))
-    results = cursor.fetchall()
+    text, markup = await get_history_page(message.from_user.id)
 
-    if results:
-        text_lines = [f"{row[0]}, {row[1]}, {row[2]}" for row in results]
-        history_text = "\n".join(text_lines)
-        await message.answer(f"🗂 Your booking history:\n\n{history_text}")
+    if text:
+        await message.answer(text, reply_markup=markup)
     else:
         await message.answer("You have no appointments yet.")
 
     await state.set_state(BookingStates.MAIN_MENU)
 
+
+@callback_router(HistoryPage)
+async def turn_history_page(callback: types.CallbackQuery, callback_data: HistoryPage):
+    # Курсор применяется только к записям того, кто нажал кнопку
+    text, markup = await get_history_page(
+        callback.from_user.id, callback_data.older, (*unpack_stamp(callback_data.stamp), callback_data.id)
+    )
+    if text:
+        await callback.message.edit_text(text, reply_markup=markup)
+    else:
+        await callback.message.edit_reply_markup()
+    await callback.answer()
+
 @dp.message(BookingStates.MAIN_MENU, F.text == "➕ New booking")
 async def start_new_booking(message: Message, state: FSMContext):
-    now = datetime.now()
-    start_of_week = now.date() - timedelta(days=now.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-
-    cursor.execute("""
-        SELECT COUNT(*) FROM appointments
-        WHERE user_id = ?
-        AND date BETWEEN ? AND ?
-    """, (message.from_user.id, start_of_week.strftime('%Y-%m-%d'), end_of_week.strftime('%Y-%m-%d')))
-    count = cursor.fetchone()[0]
+    count = (await summaries.get(message.from_user.id)).week_count
 
     if count >= 2:
         await message.answer("⚠️ For security reasons, each user is allowed to make up to 2 bookings per week.\nUnfortunately, you can't book more right now.")
         return
     
-    await message.answer("Please select a date for your appointment:", reply_markup=get_date_keyboard())
+    await message.answer("Please select a date for your appointment:", reply_markup=await get_date_keyboard(message.from_user.id))
     await state.set_state(BookingStates.WAITING_FOR_DATE)
 
 @dp.message(BookingStates.MAIN_MENU, F.text == "❌ Cancel my appointment")
@@ -346,26 +459,20 @@ async def cancel_appointment(message: Message, state: FSMContext):
     now = datetime.now()
     today = now.date()
     current_time = now.strftime('%H:%M')
-    cursor.execute("""
-        SELECT * FROM appointments
-        WHERE user_id = ? AND (
-            date > ? OR (date = ? AND time > ?)
-        )
-        ORDER BY date, time
-    """, (message.from_user.id, today, today, current_time))
-    results = cursor.fetchall()
+    summary = await summaries.get(message.from_user.id)
+    results = summary.upcoming_after(today.strftime('%Y-%m-%d'), current_time)
     if results:
         for result in results:
-            appointment_id = result[0]
-            date = result[2]
-            time = result[3]
-            name = result[4]
-            phone = result[5]
+            appointment_id = result.id
+            date = result.date
+            time = result.time
+            name = result.name
+            phone = result.phone
 
             text = f"📅 Date: {date}\n⏰ Time: {time}\n👤 Name: {name}\n📞 Phone: {phone}"
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
-                    [InlineKeyboardButton(text="❌ Cancel this", callback_data=f"ask_cancel:{appointment_id}")]
+                    [InlineKeyboardButton(text="❌ Cancel this", callback_data=AskCancel(id=appointment_id).pack())]
                 ]
             )
             await message.answer(text, reply_markup=keyboard)
@@ -376,13 +483,13 @@ async def cancel_appointment(message: Message, state: FSMContext):
 
 
 # Handler for showing cancel confirmation
-@dp.callback_query(F.data.startswith("ask_cancel:"))
-async def ask_cancel_confirmation(callback: types.CallbackQuery):
-    appointment_id = callback.data.split(":")[1]
+@callback_router(AskCancel)
+async def ask_cancel_confirmation(callback: types.CallbackQuery, callback_data: AskCancel):
+    appointment_id = callback_data.id
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Yes, cancel", callback_data=f"confirm_cancel:{appointment_id}")],
-            [InlineKeyboardButton(text="↩️ No, go back", callback_data="cancel_back")]
+            [InlineKeyboardButton(text="✅ Yes, cancel", callback_data=ConfirmCancel(id=appointment_id).pack())],
+            [InlineKeyboardButton(text="↩️ No, go back", callback_data=CancelBack().pack())]
         ]
     )
     await callback.message.edit_reply_markup(reply_markup=keyboard)
@@ -390,58 +497,122 @@ async def ask_cancel_confirmation(callback: types.CallbackQuery):
 
 
 # Handler for confirming cancellation
-@dp.callback_query(F.data.startswith("confirm_cancel:"))
-async def process_cancel(callback: types.CallbackQuery, state: FSMContext):
+@callback_router(ConfirmCancel)
+async def process_cancel(callback: types.CallbackQuery, callback_data: ConfirmCancel, state: FSMContext):
     await callback.message.edit_reply_markup()  # Убираем inline-кнопки
-    appointment_id = callback.data.split(":")[1]
-    cursor.execute("DELETE FROM appointments WHERE id = ?", (appointment_id,))
-    conn.commit()
+    appointment_id = callback_data.id
+    appointment = await db.delete_appointment(appointment_id)
+    if appointment:
+        slot_cache.mark_free(appointment.date, appointment.time, appointment.barber_id)
+        reminder_scheduler.cancel(appointment.id)
+        summaries.on_cancelled(appointment)
+        waitlist.on_freed(appointment)
 
     await callback.message.edit_text("✅ Appointment successfully canceled.")
     await callback.answer()
 
 
 # Handler for "No, go back" button
-@dp.callback_query(F.data == "cancel_back")
+@callback_router(CancelBack)
 async def cancel_back(callback: types.CallbackQuery):
     await callback.message.edit_reply_markup()
     await callback.answer("Cancellation cancelled.")
 
 
-async def reminder_loop():
-    while True:
-        now = datetime.now()
-        cursor.execute("""
-            SELECT id, user_id, date, time FROM appointments
-            WHERE reminded = 0
-        """)
-        appointments = cursor.fetchall()
+@callback_router(JoinWaitlist)
+async def join_waitlist(callback: types.CallbackQuery, callback_data: JoinWaitlist):
+    # Клавиатура остаётся: пользователь может выбрать другой день или время
+    date_str = unpack_date(callback_data.day)
+    time_str = unpack_time(callback_data.time) if callback_data.time is not None else None
+    date = bookable_date(date_str)
+    if date is None:
+        await callback.answer("⚠️ This date is not available for booking.", show_alert=True)
+        return
+    result = await waitlist.join(callback.from_user.id, date_str, time_str)
+
+    when = date.strftime('%d.%m.%Y') + (f" at {time_str}" if time_str else "")
+    if result == "joined":
+        text = f"🔔 You're on the waitlist for {when}.\nWe'll message you as soon as a slot frees up."
+    elif result == "exists":
+        text = f"You're already on the waitlist for {when}."
+    else:
+        text = f"⚠️ You can be on the waitlist for at most {WAITLIST_MAX_PER_USER} dates or times at once."
+    await callback.answer(text, show_alert=True)
+
 
-        for appt in appointments:
-            appt_id, user_id, date_str, time_str = appt
-            appt_datetime = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-            delta = appt_datetime - now
+@callback_router(ClaimOffer)
+async def claim_waitlist_offer(callback: types.CallbackQuery, callback_data: ClaimOffer, state: FSMContext):
+    if (await summaries.get(callback.from_user.id)).week_count >= 2:
+        await callback.answer("⚠️ You already have 2 bookings this week and can't book more right now.", show_alert=True)
+        return
 
-            if timedelta(hours=23, minutes=59) <= delta <= timedelta(hours=24, minutes=1):
-                try:
-                    await bot.send_message(user_id, f"🔔 Reminder: You have an appointment on {date_str} at {time_str}!")
-                    cursor.execute("UPDATE appointments SET reminded = 1 WHERE id = ?", (appt_id,))
-                    conn.commit()
-                except Exception as e:
-                    print(f"❌ Failed to send reminder to {user_id}: {e}")
+    await callback.message.edit_reply_markup()  # Убираем inline-кнопку
+    slot = await waitlist.claim(callback_data.id, callback.from_user.id)
+    barber_id = None
+    if slot is not None:
+        # Слот уже удержан за пользователем; продлеваем удержание на время ввода имени и телефона
+        date_str, time_str, barber_id = slot
+        barber_id = await reservations.hold(date_str, time_str, callback.from_user.id, [barber_id])
+    if barber_id is None:
+        await callback.message.answer("⌛ Sorry, this offer has expired.")
+        await callback.answer()
+        return
+
+    await state.update_data(date=date_str, time=time_str, barber_id=barber_id, target="time")
+    date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    await callback.message.answer(f"📅 {date.strftime('%d.%m.%Y')} at {time_str} is yours.\nPlease enter your name:")
+    await state.set_state(BookingStates.WAITING_FOR_NAME)
+    await callback.answer()
 
-        await asyncio.sleep(60)  
 
+def background_jobs():
+    # Задачи, которые во всём развёртывании должны идти ровно в одном процессе — у владельца аренды лидера
+    return [
+        reminder_scheduler.run(bot), reservations.run_expiry(), archiver.run(), backup_job.run(),
+        change_feed.run_pruning(),
+    ]
 
 
 async def main():
     print("Bot started...")
 
+    await db.init_db()
     dp.include_router(admin_router)
+    metrics.setup(dp)
+    throttling.setup(dp)
+    outbox.setup(dp, bot)
+    db.database.on_query = metrics.observe_db_query
+    metrics_runner = await metrics.start_server()
     
-    asyncio.create_task(reminder_loop())
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Изменения записей из любого процесса (и свои же) приходят дельтами из журнала appointment_changes
+    change_feed.subscribe(slot_cache.apply_changes, slot_cache.clear)
+    change_feed.subscribe(reminder_scheduler.apply_changes, reminder_scheduler.request_resync)
+    change_feed.subscribe(summaries.apply_changes, summaries.clear)
+    feed_task = asyncio.create_task(change_feed.run())
+
+    leader_task = asyncio.create_task(election.run(background_jobs))
+    # Лист ожидания разбирает слоты, освобождённые в этом процессе, поэтому он есть в каждом воркере
+    waitlist_task = asyncio.create_task(waitlist.run(bot))
+    try:
+        if BOT_MODE == "webhook":
+            await webhook.run_webhook(dp, bot)
+        elif BOT_MODE == "worker":
+            await webhook.run_worker(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        # Отдаём аренду сразу, чтобы другой воркер подхватил фоновые задачи без ожидания TTL.
+        # Все фоновые задачи дожидаемся до закрытия базы, иначе они обращаются к уже закрытому пулу
+        tasks = [leader_task, feed_task, waitlist_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await outbox.outbox.drain()
+        await dp.storage.close()
+        db.database.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
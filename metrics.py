@@ -0,0 +1,283 @@
+import os
+import time
+from datetime import datetime
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Router
+from aiogram.types import TelegramObject
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — HTTP-эндпоинт выключен
+
+# Границы корзин в секундах — от быстрых запросов к кешу до медленных вызовов Bot API
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, 21600, 86400)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (+Inf последним), сумма, количество]
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        # Оценка по верхней границе корзины — для /stats этого достаточно
+        series = self.series.get(tuple(sorted(labels.items())))
+        if not series or not series[2]:
+            return None
+        target = q * series[2]
+        seen = 0
+        for index, count in enumerate(series[0]):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+handler_latency = Histogram("bot_handler_latency_seconds", "Handler execution time")
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by handlers")
+update_latency = Histogram("bot_update_latency_seconds", "Full update processing time, including filters")
+db_query_latency = Histogram("bot_db_query_latency_seconds", "Database call time, including thread pool wait")
+reminder_lag = Histogram("bot_reminder_lag_seconds", "Delay between due time and sending of a reminder", LAG_BUCKETS)
+reminder_batch_size = Histogram("bot_reminder_batch_size", "Reminders sent per scheduler wake-up", SIZE_BUCKETS)
+reminder_failures = Counter("bot_reminder_send_failures_total", "Reminders that could not be delivered")
+throttled_updates = Counter("bot_throttled_updates_total", "Callbacks dropped by the throttling middleware")
+outbox_depth = Gauge("bot_outbox_queue_depth", "Bot API calls waiting in per-chat outbound queues")
+outbox_latency = Histogram("bot_outbox_send_latency_seconds", "Time from queueing a Bot API call to its completion")
+outbox_coalesced = Counter("bot_outbox_coalesced_total", "Keyboard removals merged with the following message")
+outbox_retries = Counter("bot_outbox_retries_total", "Bot API calls repeated after a flood-control error")
+outbox_failures = Counter("bot_outbox_failures_total", "Deferred Bot API calls that failed in the background")
+waitlist_offers = Counter("bot_waitlist_offers_total", "Freed slots offered to waitlisted users, by outcome")
+backup_running = Gauge("bot_backup_in_progress", "1 while a database snapshot is being taken")
+backup_duration = Histogram("bot_backup_duration_seconds", "Time to take, check and compress a snapshot", LAG_BUCKETS)
+backup_size = Gauge("bot_backup_size_bytes", "Size of the latest compressed snapshot")
+backup_last_success = Gauge("bot_backup_last_success_timestamp_seconds", "When the latest snapshot was written")
+backup_failures = Counter("bot_backup_failures_total", "Snapshots that could not be taken")
+# Те же апдейты, что и в update_latency, но только пришедшие во время снятия копии — для сравнения
+backup_update_latency = Histogram(
+    "bot_update_latency_during_backup_seconds", "Full update processing time while a backup is running"
+)
+
+REGISTRY = [
+    handler_latency, handler_errors, update_latency, db_query_latency,
+    reminder_lag, reminder_batch_size, reminder_failures, throttled_updates,
+    outbox_depth, outbox_latency, outbox_coalesced, outbox_retries, outbox_failures, waitlist_offers,
+    backup_running, backup_duration, backup_size, backup_last_success, backup_failures, backup_update_latency,
+]
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_db_query(statement: str, seconds: float):
+    db_query_latency.observe(seconds, statement=statement)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Внешний middleware: полное время обработки апдейта, включая фильтры всех роутеров
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        event_type = getattr(event, "event_type", type(event).__name__)
+        during_backup = backup_running.get() > 0
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            update_latency.observe(elapsed, event=event_type)
+            if during_backup or backup_running.get() > 0:
+                backup_update_latency.observe(elapsed, event=event_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware: здесь уже известно, какой именно хендлер сработал
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        # Для callback-ов через CallbackRouter настоящий хендлер лежит в найденном маршруте
+        route = data.get("callback_route")
+        handler_object = route.handler if route is not None else getattr(data.get("handler"), "callback", None)
+        name = getattr(handler_object, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, handler=name)
+
+
+def setup(dp: Router):
+    # Внутренние middleware диспетчера действуют и на вложенные роутеры (admin_router),
+    # поэтому регистрируем их один раз, иначе хендлеры админки считались бы дважды
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_middleware)
+    dp.callback_query.middleware(handler_middleware)
+
+
+def format_stats(top: int = 8) -> str:
+    lines = ["📈 Bot stats", ""]
+
+    handlers = sorted(handler_latency.series.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    if handlers:
+        lines.append("Handlers (calls, avg, p95):")
+        for labels, (_, total, count) in handlers:
+            name = dict(labels)["handler"]
+            p95 = handler_latency.quantile(0.95, handler=name)
+            errors = handler_errors.values.get(labels, 0)
+            error_text = f", ❌ {int(errors)}" if errors else ""
+            lines.append(f"• {name}: {count}, {total / count * 1000:.1f} ms, ≤{p95 * 1000:g} ms{error_text}")
+        lines.append("")
+
+    db_calls = sum(series[2] for series in db_query_latency.series.values())
+    db_time = sum(series[1] for series in db_query_latency.series.values())
+    if db_calls:
+        lines.append(f"DB: {db_calls} queries, avg {db_time / db_calls * 1000:.2f} ms")
+        slowest = max(db_query_latency.series.items(), key=lambda item: item[1][1] / item[1][2])
+        lines.append(f"Slowest: {dict(slowest[0])['statement']} ({slowest[1][1] / slowest[1][2] * 1000:.2f} ms avg)")
+        lines.append("")
+
+    sent = sum(series[1] for series in reminder_batch_size.series.values())
+    failed = sum(reminder_failures.values.values())
+    lag_p95 = reminder_lag.quantile(0.95)
+    lag_text = f", lag p95 ≤{lag_p95:g}s" if lag_p95 is not None else ""
+    lines.append(f"Reminders: {int(sent)} due, {int(failed)} failed{lag_text}")
+    throttled = sum(throttled_updates.values.values())
+    if throttled:
+        lines.append(f"Throttled callbacks: {int(throttled)}")
+
+    sends = sum(series[2] for series in outbox_latency.series.values())
+    if sends:
+        send_time = sum(series[1] for series in outbox_latency.series.values())
+        depth = sum(outbox_depth.values.values())
+        coalesced = sum(outbox_coalesced.values.values())
+        lines.append(
+            f"Outbox: {sends} calls, avg {send_time / sends * 1000:.1f} ms, "
+            f"{int(coalesced)} merged, {int(depth)} queued"
+        )
+
+    last_backup = backup_last_success.get()
+    if last_backup or backup_failures.values:
+        failures = sum(backup_failures.values.values())
+        if last_backup:
+            took = backup_duration.series[()][1] / backup_duration.series[()][2]
+            lines.append(
+                f"Backup: last {datetime.fromtimestamp(last_backup):%d.%m %H:%M}, "
+                f"{backup_size.get() / 1024 / 1024:.1f} MB, avg {took:.1f}s" + (f", ❌ {int(failures)}" if failures else "")
+            )
+        else:
+            lines.append(f"Backup: ❌ {int(failures)} failed, none succeeded")
+        if backup_update_latency.series:
+            # Самый частый тип апдейта во время копирования: p95 во время неё против p95 за всё время
+            labels = max(backup_update_latency.series, key=lambda key: backup_update_latency.series[key][2])
+            event = dict(labels)["event"]
+            during = backup_update_latency.quantile(0.95, event=event)
+            overall = update_latency.quantile(0.95, event=event)
+            lines.append(f"{event} p95 during backup ≤{during * 1000:g} ms, overall ≤{overall * 1000:g} ms")
+    return "\n".join(lines)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
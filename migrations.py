@@ -0,0 +1,411 @@
+import sqlite3
+import sys
+
+
+# Каждая миграция применяется один раз, номер версии хранится в PRAGMA user_version
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            reminded INTEGER DEFAULT 0
+        )
+    ''')
+
+
+def _indexes_and_unique_slot(conn: sqlite3.Connection):
+    # Старые двойные записи на один слот переносим в отдельную таблицу, чтобы не потерять их
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointments_duplicates AS
+        SELECT * FROM appointments WHERE 0
+    ''')
+    conn.execute('''
+        INSERT INTO appointments_duplicates
+        SELECT * FROM appointments a
+        WHERE EXISTS (
+            SELECT 1 FROM appointments b
+            WHERE b.date = a.date AND b.time = a.time AND b.id < a.id
+        )
+    ''')
+    conn.execute('DELETE FROM appointments WHERE id IN (SELECT id FROM appointments_duplicates)')
+
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_slot ON appointments (date, time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_appointments_user ON appointments (user_id, date, time)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_appointments_unreminded
+        ON appointments (date, time) WHERE reminded = 0
+    ''')
+
+
+def _fsm_states(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+
+def _slot_holds(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS slot_holds (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (date, time)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slot_holds_user ON slot_holds (user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slot_holds_expires ON slot_holds (expires_at)')
+
+
+def _barbers(conn: sqlite3.Connection):
+    # Несколько кресел: слот уникален в пределах барбера; старые записи — первому креслу
+    conn.execute('ALTER TABLE appointments ADD COLUMN barber_id INTEGER NOT NULL DEFAULT 1')
+    conn.execute('DROP INDEX IF EXISTS idx_appointments_slot')
+    conn.execute('CREATE UNIQUE INDEX idx_appointments_slot ON appointments (date, time, barber_id)')
+    # Удержания живут минуты, их можно просто пересоздать с новым ключом
+    conn.execute('DROP TABLE IF EXISTS slot_holds')
+    conn.execute('''
+        CREATE TABLE slot_holds (
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            barber_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (date, time, barber_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slot_holds_user ON slot_holds (user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slot_holds_expires ON slot_holds (expires_at)')
+
+
+def _appointment_history(conn: sqlite3.Connection):
+    # Архив прошедших записей: id сохраняется, month ("YYYY-MM") позволяет работать с архивом помесячно
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointment_history (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            reminded INTEGER DEFAULT 0,
+            barber_id INTEGER NOT NULL DEFAULT 1,
+            month TEXT NOT NULL,
+            archived_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_month ON appointment_history (month, date, time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_user ON appointment_history (user_id, date, time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_slot ON appointment_history (date, time, barber_id)')
+
+
+# Агрегаты занятости: таблица -> выражение ключа над строкой записи
+STATS_TABLES = {
+    "stats_daily": ("date", "TEXT"),
+    "stats_slot": ("time", "TEXT"),
+    "stats_weekday": ("weekday", "INTEGER"),
+}
+STATS_KEY_EXPRESSIONS = {
+    "stats_daily": "{row}.date",
+    "stats_slot": "{row}.time",
+    "stats_weekday": "CAST(strftime('%w', {row}.date) AS INTEGER)",  # 0 — воскресенье
+}
+
+
+def _booking_stats(conn: sqlite3.Connection):
+    # Отменённые записи нужны, чтобы агрегаты можно было пересчитать с нуля
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointment_cancellations (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            barber_id INTEGER NOT NULL,
+            cancelled_at REAL NOT NULL
+        )
+    ''')
+    for table, (key, key_type) in STATS_TABLES.items():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} {key_type} PRIMARY KEY,
+                booked INTEGER NOT NULL DEFAULT 0,
+                cancelled INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+
+    # Счётчики обновляются в той же транзакции, что и запись: +1 к booked на INSERT,
+    # +1 к cancelled на DELETE. Перенос в архив отменой не считается — строка уже лежит в appointment_history
+    on_insert = "\n".join(
+        f"INSERT INTO {table} ({key}, booked) VALUES ({STATS_KEY_EXPRESSIONS[table].format(row='NEW')}, 1) "
+        f"ON CONFLICT ({key}) DO UPDATE SET booked = booked + 1;"
+        for table, (key, _) in STATS_TABLES.items()
+    )
+    on_cancel = "\n".join(
+        f"UPDATE {table} SET cancelled = cancelled + 1 WHERE {key} = {STATS_KEY_EXPRESSIONS[table].format(row='OLD')};"
+        for table, (key, _) in STATS_TABLES.items()
+    )
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_booked AFTER INSERT ON appointments
+        BEGIN
+            {on_insert}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_cancelled AFTER DELETE ON appointments
+        WHEN NOT EXISTS (SELECT 1 FROM appointment_history WHERE id = OLD.id)
+        BEGIN
+            INSERT OR REPLACE INTO appointment_cancellations (id, user_id, date, time, barber_id, cancelled_at)
+            VALUES (OLD.id, OLD.user_id, OLD.date, OLD.time, OLD.barber_id, CAST(strftime('%s', 'now') AS REAL));
+            {on_cancel}
+        END
+    ''')
+
+    # Уже существующие записи: история отмен до этой версии не сохранялась
+    for table, (key, _) in STATS_TABLES.items():
+        expression = STATS_KEY_EXPRESSIONS[table].format(row="a")
+        conn.execute(f'''
+            INSERT INTO {table} ({key}, booked)
+            SELECT {expression}, COUNT(*) FROM (
+                SELECT date, time FROM appointments
+                UNION ALL
+                SELECT date, time FROM appointment_history
+            ) a GROUP BY 1
+        ''')
+
+
+def _waitlist(conn: sqlite3.Connection):
+    # time IS NULL — ждём любое время в этот день; offer_* заполнены, пока освободившийся слот придержан за ожидающим
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT,
+            created_at REAL NOT NULL,
+            offer_time TEXT,
+            offer_barber INTEGER,
+            offer_expires REAL
+        )
+    ''')
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_waitlist_user_slot ON waitlist (user_id, date, IFNULL(time, ''))"
+    )
+    # Очередь на освободившийся слот: все ожидающие этого дня в порядке записи в лист
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_waitlist_date ON waitlist (date, id)')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_waitlist_offers ON waitlist (offer_expires) WHERE offer_expires IS NOT NULL'
+    )
+
+
+def _leases(conn: sqlite3.Connection):
+    # Аренда роли: кто держит (holder) и до какого момента; продлевает только владелец или любой после истечения
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _closures(conn: sqlite3.Connection):
+    # Закрытые админом часы, по строке на день: [start_time, end_time), "00:00"-"24:00" — весь день;
+    # barber_id IS NULL — закрыты все кресла
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS closures (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            barber_id INTEGER,
+            reason TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_closures_date ON closures (date)')
+
+
+CHANGE_COLUMNS = "appointment_id, user_id, date, time, name, phone, reminded, barber_id"
+
+
+def _appointment_changes(conn: sqlite3.Connection):
+    # Журнал изменений appointments. Пишут триггеры, то есть в той же транзакции, что и само изменение,
+    # из любого кода и любого процесса. AUTOINCREMENT не переиспользует номера, а единственный писатель
+    # SQLite фиксирует транзакции в порядке seq — читателю достаточно помнить последний seq
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS appointment_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            appointment_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT,
+            phone TEXT,
+            reminded INTEGER NOT NULL,
+            barber_id INTEGER NOT NULL,
+            changed_at REAL NOT NULL
+        )
+    ''')
+    changed_at = "CAST(strftime('%s', 'now') AS REAL)"
+    for event, op, row in (
+        ("INSERT", "'insert'", "NEW"),
+        ("UPDATE", "'update'", "NEW"),
+        # Архиватор сначала копирует запись в appointment_history, потом удаляет — это не отмена
+        ("DELETE", "CASE WHEN EXISTS (SELECT 1 FROM appointment_history WHERE id = OLD.id) "
+                   "THEN 'archive' ELSE 'delete' END", "OLD"),
+    ):
+        values = ", ".join(f"{row}.{column}" for column in ("id", *CHANGE_COLUMNS.split(", ")[1:]))
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_appointment_changes_{event.lower()} AFTER {event} ON appointments
+            BEGIN
+                INSERT INTO appointment_changes (op, {CHANGE_COLUMNS}, changed_at)
+                VALUES ({op}, {values}, {changed_at});
+            END
+        ''')
+
+
+MIGRATIONS = [
+    _initial_schema,
+    _indexes_and_unique_slot,
+    _fsm_states,
+    _slot_holds,
+    _barbers,
+    _appointment_history,
+    _booking_stats,
+    _waitlist,
+    _leases,
+    _closures,
+    _appointment_changes,
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    version = get_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # isolation_level=None отключает неявные транзакции, поэтому BEGIN/COMMIT ставим сами
+        previous_isolation = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if get_version(conn) >= number:
+                conn.execute("COMMIT")
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.isolation_level = previous_isolation
+    return get_version(conn)
+
+
+# Запросы, которые выполняются на каждое нажатие кнопки или в фоне.
+# Каждый из них обязан идти через индекс, а не полным сканированием таблицы.
+HOT_QUERIES = {
+    "booked_slots": (
+        "SELECT date, time, barber_id FROM appointments WHERE date BETWEEN ? AND ?", ("2024-01-01", "2024-01-21")
+    ),
+    "count_on_date": ("SELECT COUNT(*) FROM appointments WHERE date = ?", ("2024-01-01",)),
+    "user_history": (
+        "SELECT * FROM appointments WHERE user_id = ? AND (date, time, id) < (?, ?, ?) "
+        "ORDER BY date DESC, time DESC, id DESC LIMIT 11",
+        (1, "2024-01-01", "10:00", 5),
+    ),
+    "last_appointment": (
+        "SELECT * FROM appointments WHERE user_id = ? ORDER BY date DESC, time DESC LIMIT 1", (1,)
+    ),
+    "weekly_limit": (
+        "SELECT COUNT(*) FROM appointments WHERE user_id = ? AND date BETWEEN ? AND ?",
+        (1, "2024-01-01", "2024-01-07"),
+    ),
+    "bookings_page": (
+        "SELECT * FROM appointments WHERE (date, time, barber_id) > (?, ?, ?) "
+        "ORDER BY date, time, barber_id LIMIT 11",
+        ("2024-01-01", "10:00", 1),
+    ),
+    "bookings_page_on_date": (
+        "SELECT * FROM appointments WHERE date = ? AND (date, time, barber_id) < (?, ?, ?) "
+        "ORDER BY date DESC, time DESC, barber_id DESC LIMIT 11",
+        ("2024-01-01", "2024-01-01", "10:00", 1),
+    ),
+    "upcoming_unreminded": (
+        "SELECT * FROM appointments WHERE reminded = 0 AND date >= ? ORDER BY date, time", ("2024-01-01",)
+    ),
+    "archive_batch": (
+        "SELECT id FROM appointments WHERE date < ? ORDER BY date, time LIMIT 500", ("2024-01-01",)
+    ),
+    "history_user": (
+        "SELECT * FROM appointment_history WHERE user_id = ? AND (date, time, id) > (?, ?, ?) "
+        "ORDER BY date, time, id LIMIT 11",
+        (1, "2024-01-01", "10:00", 5),
+    ),
+    "history_page": (
+        "SELECT * FROM appointment_history WHERE (date, time, barber_id) > (?, ?, ?) "
+        "ORDER BY date, time, barber_id LIMIT 11",
+        ("2024-01-01", "10:00", 1),
+    ),
+    "waitlist_slot": (
+        "SELECT id, user_id FROM waitlist WHERE date = ? AND (time = ? OR time IS NULL) "
+        "AND offer_expires IS NULL ORDER BY id LIMIT 20",
+        ("2024-01-01", "10:00"),
+    ),
+    "closures_between": (
+        "SELECT date, start_time, end_time, barber_id FROM closures WHERE date BETWEEN ? AND ?",
+        ("2024-01-01", "2024-01-21"),
+    ),
+    "closed_slot": (
+        "SELECT 1 FROM closures c WHERE c.date = ? AND (c.barber_id IS NULL OR c.barber_id = ?) "
+        "AND c.start_time <= ? AND ? < c.end_time",
+        ("2024-01-01", 1, "10:00", "10:00"),
+    ),
+    "waitlist_expired_offers": (
+        "SELECT id, date, offer_time, offer_barber FROM waitlist WHERE offer_expires < ?", (0.0,)
+    ),
+}
+
+
+def check_query_plans(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    # Возвращает запросы, в плане которых есть полный SCAN по таблице записей или временный B-tree для сортировки
+    failures = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        uses_index = any("USING" in step and "INDEX" in step for step in plan)
+        bad_steps = [
+            step for step in plan
+            if step in ("SCAN appointments", "SCAN appointment_history") or "USE TEMP B-TREE" in step
+        ]
+        if not uses_index or bad_steps:
+            failures[name] = plan
+    return failures
+
+
+if __name__ == "__main__":
+    # python migrations.py [path] — применить миграции и проверить планы горячих запросов
+    path = sys.argv[1] if len(sys.argv) > 1 else "database.db"
+    connection = sqlite3.connect(path)
+    print(f"Schema version: {migrate(connection)}")
+    failed = check_query_plans(connection)
+    for query_name, query_plan in failed.items():
+        print(f"❌ {query_name}: {query_plan}")
+    connection.close()
+    sys.exit(1 if failed else 0)
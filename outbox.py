@@ -0,0 +1,294 @@
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    DeleteMessage,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.types import InlineKeyboardMarkup, Message, TelegramObject, Update
+
+import metrics
+
+# Сколько удаление клавиатуры ждёт следующего сообщения в тот же чат, чтобы слиться с ним в одно edit_text
+OUTBOX_COALESCE_WINDOW = float(os.getenv("OUTBOX_COALESCE_WINDOW", "0.5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "3"))
+# Дольше этого на 429 не ждём: хендлер, висящий минуту, хуже честной ошибки
+OUTBOX_MAX_RETRY_AFTER = float(os.getenv("OUTBOX_MAX_RETRY_AFTER", "30"))
+OUTBOX_MAX_CHATS = int(os.getenv("OUTBOX_MAX_CHATS", "10000"))
+
+# Вызовы, результат которых хендлеры не используют: ставим в очередь и сразу отвечаем True
+DEFERRED_METHODS = (EditMessageReplyMarkup, DeleteMessage)
+# Поля sendMessage, которые переносятся в editMessageText; с любым другим заданным полем не склеиваем
+MERGED_FIELDS = ("text", "parse_mode", "entities", "link_preview_options", "disable_web_page_preview", "reply_markup")
+IGNORED_FIELDS = ("chat_id", "disable_notification")
+
+# Чаты, в которые пишет текущий апдейт: по его окончании отложенные удаления клавиатур уходят сразу
+_update_chats: contextvars.ContextVar[Optional[set[int]]] = contextvars.ContextVar("outbox_update_chats", default=None)
+
+
+class _Call:
+    __slots__ = ("method", "make_request", "bot", "future", "held", "queued_at", "fallback")
+
+    def __init__(self, method: TelegramMethod, make_request: NextRequestMiddlewareType, bot: Bot, deferred: bool):
+        self.method = method
+        self.make_request = make_request
+        self.bot = bot
+        # У отложенного вызова результата никто не ждёт — ошибки только в лог и метрики
+        self.future: Optional[asyncio.Future] = None if deferred else asyncio.get_running_loop().create_future()
+        self.held = False
+        self.queued_at = time.perf_counter()
+        # Склеенный вызов: если Telegram не дал отредактировать, выполняем исходные по очереди
+        self.fallback: list["_Call"] = []
+
+
+class _ChatQueue:
+    __slots__ = ("calls", "wakeup", "worker")
+
+    def __init__(self):
+        self.calls: deque[_Call] = deque()
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+
+
+def _is_keyboard_removal(method: TelegramMethod) -> bool:
+    return (
+        isinstance(method, EditMessageReplyMarkup)
+        and method.reply_markup is None
+        and method.message_id is not None
+        and method.inline_message_id is None
+    )
+
+
+def _merge(removal: EditMessageReplyMarkup, send: TelegramMethod) -> Optional[EditMessageText]:
+    # «Убрать кнопки у сообщения + прислать новое» -> одно редактирование того же сообщения
+    if not isinstance(send, SendMessage):
+        return None
+    if send.reply_markup is not None and not isinstance(send.reply_markup, InlineKeyboardMarkup):
+        return None
+    for name, value in send:
+        if name in MERGED_FIELDS or name in IGNORED_FIELDS:
+            continue
+        if value is not None and not isinstance(value, Default):
+            return None
+    return EditMessageText(
+        chat_id=removal.chat_id, message_id=removal.message_id,
+        **{name: getattr(send, name) for name in MERGED_FIELDS},
+    )
+
+
+class Outbox(BaseRequestMiddleware):
+    # Middleware сессии бота: все вызовы Bot API с числовым chat_id идут через очередь своего чата.
+    # Порядок внутри чата сохраняется, разные чаты отправляются параллельно
+    def __init__(
+        self,
+        coalesce_window: float = OUTBOX_COALESCE_WINDOW,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        max_retry_after: float = OUTBOX_MAX_RETRY_AFTER,
+        max_chats: int = OUTBOX_MAX_CHATS,
+    ):
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.max_retry_after = max_retry_after
+        self.max_chats = max_chats
+        self._chats: dict[int, _ChatQueue] = {}
+        self._background: set[asyncio.Task] = set()
+        # Последнее известное сообщение в чате: склеивать можно, только если кнопки убираются у него,
+        # иначе новый текст появился бы где-то выше в истории
+        self._last_message: OrderedDict[int, int] = OrderedDict()
+        # Сколько раз в чате перерисовывали сообщения. Склеенный edit_text оставляет прежний message_id,
+        # и без счётчика антидребезг принял бы нажатие новой кнопки за повтор старой
+        self._edits: OrderedDict[int, int] = OrderedDict()
+
+    def remember_message(self, chat_id: int, message_id: int):
+        if message_id >= self._last_message.get(chat_id, 0):
+            self._last_message[chat_id] = message_id
+            self._last_message.move_to_end(chat_id)
+            if len(self._last_message) > self.max_chats:
+                self._last_message.popitem(last=False)
+
+    def edit_count(self, chat_id: int) -> int:
+        return self._edits.get(chat_id, 0)
+
+    def _count_edit(self, chat_id: int):
+        self._edits[chat_id] = self._edits.get(chat_id, 0) + 1
+        self._edits.move_to_end(chat_id)
+        if len(self._edits) > self.max_chats:
+            self._edits.popitem(last=False)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        if isinstance(method, AnswerCallbackQuery):
+            # Ответ на нажатие ни с чем не упорядочен — отправляем сразу, не дожидаясь
+            self._spawn(self._execute(_Call(method, make_request, bot, deferred=True), None))
+            return True
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            # getUpdates, getMe, чаты по @username — мимо очередей
+            return await make_request(bot, method)
+
+        call = _Call(method, make_request, bot, deferred=isinstance(method, DEFERRED_METHODS))
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue()
+        self._enqueue(chat_id, queue, call)
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._drain(chat_id, queue))
+        return True if call.future is None else await call.future
+
+    def _enqueue(self, chat_id: int, queue: _ChatQueue, call: _Call):
+        tail = queue.calls[-1] if queue.calls else None
+        if tail is not None and tail.held:
+            tail.held = False
+            queue.wakeup.set()
+            merged = _merge(tail.method, call.method)
+            if merged is not None:
+                metrics.outbox_coalesced.inc()
+                combined = _Call(merged, call.make_request, call.bot, deferred=False)
+                combined.future, combined.queued_at, combined.fallback = call.future, tail.queued_at, [tail, call]
+                queue.calls[-1] = combined
+                return
+
+        chats = _update_chats.get()
+        if (
+            chats is not None
+            and _is_keyboard_removal(call.method)
+            and self._last_message.get(chat_id) == call.method.message_id
+        ):
+            # Придерживаем до следующего вызова в этот чат, конца апдейта или истечения окна
+            call.held = True
+            chats.add(chat_id)
+        queue.calls.append(call)
+        metrics.outbox_depth.inc()
+
+    def release(self, chat_id: int):
+        queue = self._chats.get(chat_id)
+        if queue is not None and queue.calls and queue.calls[-1].held:
+            queue.calls[-1].held = False
+            queue.wakeup.set()
+
+    async def _drain(self, chat_id: int, queue: _ChatQueue):
+        try:
+            while queue.calls:
+                call = queue.calls[0]
+                if call.held:
+                    queue.wakeup.clear()
+                    remaining = call.queued_at + self.coalesce_window - time.perf_counter()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(queue.wakeup.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                    if queue.calls and queue.calls[0] is call:
+                        call.held = False
+                    continue
+                queue.calls.popleft()
+                metrics.outbox_depth.dec()
+                await self._execute(call, chat_id)
+        finally:
+            queue.worker = None
+            if not queue.calls and self._chats.get(chat_id) is queue:
+                del self._chats[chat_id]
+
+    async def _execute(self, call: _Call, chat_id: Optional[int]):
+        name = type(call.method).__name__
+        error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            try:
+                result = await call.make_request(call.bot, call.method)
+            except TelegramRetryAfter as e:
+                error = e
+                if attempt + 1 == self.max_attempts or e.retry_after > self.max_retry_after:
+                    break
+                metrics.outbox_retries.inc(method=name)
+                # Очередь чата стоит, пока не истечёт retry_after, — порядок не нарушается
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if call.fallback:
+                    for original in call.fallback:
+                        original.queued_at = call.queued_at
+                        await self._execute(original, chat_id)
+                    return
+                error = e
+                break
+            except asyncio.CancelledError:
+                if call.future is not None and not call.future.done():
+                    call.future.cancel()
+                raise
+            except Exception as e:
+                error = e
+                break
+            else:
+                if chat_id is not None and isinstance(result, Message):
+                    self.remember_message(chat_id, result.message_id)
+                if chat_id is not None and isinstance(call.method, (EditMessageText, EditMessageReplyMarkup)):
+                    self._count_edit(chat_id)
+                metrics.outbox_latency.observe(time.perf_counter() - call.queued_at, method=name)
+                if call.future is not None and not call.future.done():
+                    call.future.set_result(result)
+                return
+
+        metrics.outbox_latency.observe(time.perf_counter() - call.queued_at, method=name)
+        if call.future is not None:
+            if not call.future.done():
+                call.future.set_exception(error)
+        else:
+            metrics.outbox_failures.inc(method=name)
+            print(f"❌ {name} to chat {chat_id} failed: {error}")
+
+    def _spawn(self, coroutine: Awaitable):
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def drain(self):
+        # Дождаться, пока уйдут все поставленные в очередь вызовы (перед остановкой бота)
+        while True:
+            for chat_id in list(self._chats):
+                self.release(chat_id)
+            tasks = [queue.worker for queue in self._chats.values() if queue.worker is not None]
+            tasks.extend(self._background)
+            if not tasks:
+                return
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class UpdateScopeMiddleware(BaseMiddleware):
+    # Внешний middleware апдейтов: помечает чаты, куда пишет хендлер, и отпускает придержанные вызовы в конце
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        if event.message is not None:
+            self.outbox.remember_message(event.message.chat.id, event.message.message_id)
+        chats: set[int] = set()
+        token = _update_chats.set(chats)
+        try:
+            return await handler(event, data)
+        finally:
+            _update_chats.reset(token)
+            for chat_id in chats:
+                self.outbox.release(chat_id)
+
+
+outbox = Outbox()
+
+
+def setup(dp: Router, bot: Bot):
+    bot.session.middleware(outbox)
+    dp.update.outer_middleware(UpdateScopeMiddleware(outbox))
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db
+import delivery
+import metrics
+
+REMIND_BEFORE = timedelta(hours=24)
+# Пропущенные (например, во время простоя) напоминания досылаем, только если до записи ещё есть время
+RECOVERY_MIN_LEAD = timedelta(hours=1)
+RETRY_DELAY = timedelta(seconds=60)
+# Пауза после ошибки цикла (например, «database is locked»), прежде чем пробовать снова
+ERROR_DELAY = 5.0
+# Записи других воркеров приходят через журнал изменений; периодическое перечитывание очереди
+# из базы — только страховка (0 — выключено)
+RESYNC_INTERVAL = float(os.getenv("REMINDER_RESYNC_INTERVAL", "0"))
+
+
+def appointment_datetime(appointment: db.Appointment) -> datetime:
+    return datetime.strptime(f"{appointment.date} {appointment.time}", "%Y-%m-%d %H:%M")
+
+
+class ReminderScheduler:
+    # Мин-куча (время напоминания, id записи); спим ровно до ближайшего напоминания
+    def __init__(self, resync_interval: float = RESYNC_INTERVAL):
+        self.resync_interval = resync_interval
+        self._heap: list[tuple[datetime, int]] = []
+        self._appointments: dict[int, db.Appointment] = {}
+        self._wake: Optional[asyncio.Event] = None
+        # Отправленные напоминания, которые ещё не удалось отметить в базе: не шлём их повторно
+        self._unmarked: list[int] = []
+        # Журнал изменений потерял часть дельт — очередь надо перечитать из базы
+        self._resync_requested = False
+        # Очередь ведёт только процесс, в котором запущен run() (лидер); в остальных push — no-op
+        self._running = False
+
+    def _event(self) -> asyncio.Event:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    def __len__(self):
+        return len(self._appointments)
+
+    def _schedule(self, appointment: db.Appointment, remind_at: datetime):
+        self._appointments[appointment.id] = appointment
+        heapq.heappush(self._heap, (remind_at, appointment.id))
+        self._event().set()
+
+    async def load(self):
+        # Загружаем только будущие записи без напоминания, включая просроченные напоминания
+        now = datetime.now()
+        appointments = await db.get_upcoming_unreminded(now.strftime("%Y-%m-%d"))
+        for appointment in appointments:
+            appointment_at = appointment_datetime(appointment)
+            if appointment.id not in self._unmarked and appointment_at - now >= RECOVERY_MIN_LEAD:
+                self._schedule(appointment, appointment_at - REMIND_BEFORE)
+
+    def push(self, appointment: db.Appointment):
+        # Своя запись приходит ещё раз из журнала изменений — второй элемент в кучу не кладём
+        if not self._running or appointment.id in self._appointments:
+            return
+        # Запись сделана меньше чем за сутки — напоминать нечего, как и раньше
+        remind_at = appointment_datetime(appointment) - REMIND_BEFORE
+        if remind_at > datetime.now():
+            self._schedule(appointment, remind_at)
+
+    def cancel(self, appointment_id: int):
+        # Элемент кучи остаётся, но без записи в _appointments он будет пропущен
+        self._appointments.pop(appointment_id, None)
+
+    def apply_changes(self, changes):
+        for change in changes:
+            if change.op == "insert":
+                self.push(change.appointment)
+            elif change.op in ("delete", "archive") or change.appointment.reminded:
+                self.cancel(change.appointment.id)
+
+    def request_resync(self):
+        if self._running:
+            self._resync_requested = True
+            self._event().set()
+
+    def _pop_due(self, now: datetime) -> list[db.Appointment]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            remind_at, appointment_id = heapq.heappop(self._heap)
+            appointment = self._appointments.pop(appointment_id, None)
+            if appointment is not None:
+                metrics.reminder_lag.observe((now - remind_at).total_seconds())
+                due.append(appointment)
+        if due:
+            metrics.reminder_batch_size.observe(len(due))
+        return due
+
+    def _next_delay(self, now: datetime) -> Optional[float]:
+        # Выкидываем с вершины отменённые записи, чтобы не просыпаться зря
+        while self._heap and self._heap[0][1] not in self._appointments:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - now).total_seconds(), 0)
+
+    async def _wait(self, delay: Optional[float]):
+        event = self._event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def _send_batch(self, bot, appointments: list[db.Appointment]):
+        if self.resync_interval:
+            # Запись могли отменить в другом процессе уже после последнего перечитывания
+            existing = {a.id for a in await db.get_appointments_by_ids([a.id for a in appointments])}
+            appointments = [a for a in appointments if a.id in existing]
+            if not appointments:
+                return
+        errors = await delivery.send_many(bot, [
+            (a.user_id, f"🔔 Reminder: You have an appointment on {a.date} at {a.time}!")
+            for a in appointments
+        ])
+
+        done = []
+        for appointment, error in zip(appointments, errors):
+            if error is None:
+                done.append(appointment.id)
+                continue
+            print(f"❌ Failed to send reminder to {appointment.user_id}: {error}")
+            metrics.reminder_failures.inc()
+            if delivery.is_permanent(error):
+                # Бот заблокирован пользователем — больше не пытаемся
+                done.append(appointment.id)
+            elif appointment_datetime(appointment) - datetime.now() >= RECOVERY_MIN_LEAD:
+                self._schedule(appointment, datetime.now() + RETRY_DELAY)
+        self._unmarked.extend(done)
+        await self._mark_reminded()
+
+    async def _mark_reminded(self):
+        await db.mark_reminded_many(self._unmarked)
+        self._unmarked = []
+
+    async def _reload(self):
+        heap, appointments = self._heap, self._appointments
+        self._heap, self._appointments = [], {}
+        try:
+            await self.load()
+        except Exception:
+            # Не смогли перечитать — остаёмся со старой очередью, а не с пустой
+            self._heap, self._appointments = heap, appointments
+            raise
+
+    def _requeue(self, appointments: list[db.Appointment]):
+        # Напоминания, снятые с кучи, но не отправленные из-за ошибки, возвращаем в очередь
+        for appointment in appointments:
+            if appointment.id not in self._unmarked and appointment.id not in self._appointments:
+                self._schedule(appointment, datetime.now() + RETRY_DELAY)
+
+    async def run(self, bot):
+        self._running = True
+        try:
+            # Первая загрузка — тоже через resync в цикле, чтобы её ошибка не останавливала планировщик
+            self._resync_requested = True
+            synced_at = datetime.now()
+            while True:
+                now = datetime.now()
+                due = []
+                try:
+                    if self._unmarked:
+                        await self._mark_reminded()
+                    if self._resync_requested or (
+                        self.resync_interval and (now - synced_at).total_seconds() >= self.resync_interval
+                    ):
+                        await self._reload()
+                        self._resync_requested = False
+                        synced_at = now
+                    due = self._pop_due(now)
+                    if due:
+                        await self._send_batch(bot, due)
+                except Exception as e:
+                    print(f"❌ Reminder loop failed: {e}")
+                    self._requeue(due)
+                    await asyncio.sleep(ERROR_DELAY)
+                    continue
+                delay = self._next_delay(datetime.now())
+                if self.resync_interval:
+                    until_resync = self.resync_interval - (datetime.now() - synced_at).total_seconds()
+                    delay = max(0.0, until_resync) if delay is None else min(delay, max(0.0, until_resync))
+                await self._wait(delay)
+        finally:
+            self._running = False
+            self._heap, self._appointments, self._unmarked = [], {}, []
+
+
+scheduler = ReminderScheduler()
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+import db
+from closures import SLOT_CLOSED_SQL
+from schedule import schedule
+
+# Сколько держим слот за пользователем, пока он вводит имя и телефон
+HOLD_TTL = float(os.getenv("HOLD_TTL", str(10 * 60)))
+EXPIRE_INTERVAL = 60
+# Удержания ставят все воркеры: раз в столько секунд перечитываем активные из базы
+HOLDS_REFRESH_INTERVAL = float(os.getenv("HOLDS_REFRESH_INTERVAL", "2"))
+
+
+def _insert_hold(conn, date: str, time_str: str, barber_id: int, user_id: int, now: float, expires_at: float) -> bool:
+    # Один условный upsert: кресло в этот слот не занято записью и не удержано кем-то ещё
+    cur = conn.execute(f'''
+        INSERT INTO slot_holds (date, time, barber_id, user_id, expires_at)
+        SELECT ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM appointments WHERE date = ? AND time = ? AND barber_id = ?)
+          AND NOT {SLOT_CLOSED_SQL}
+        ON CONFLICT (date, time, barber_id) DO UPDATE SET
+            user_id = excluded.user_id, expires_at = excluded.expires_at
+        WHERE slot_holds.user_id = excluded.user_id OR slot_holds.expires_at < ?
+    ''', (
+        date, time_str, barber_id, user_id, expires_at, date, time_str, barber_id,
+        date, barber_id, time_str, time_str, now,
+    ))
+    return cur.rowcount == 1
+
+
+def _place_hold(conn, date: str, time_str: str, barber_ids: list[int], user_id: int, now: float, expires_at: float) -> Optional[int]:
+    with conn:
+        for barber_id in barber_ids:
+            if _insert_hold(conn, date, time_str, barber_id, user_id, now, expires_at):
+                # У пользователя может быть только одно удержание — прошлое отпускаем
+                conn.execute(
+                    "DELETE FROM slot_holds WHERE user_id = ? AND NOT (date = ? AND time = ? AND barber_id = ?)",
+                    (user_id, date, time_str, barber_id)
+                )
+                return barber_id
+    return None
+
+
+def _book_held(
+    conn, user_id: int, date: str, time_str: str, barber_id: int, name: str, phone: str, now: float
+) -> Optional[int]:
+    with conn:
+        # Запись проходит, только если кресло не удержано другим пользователем; UNIQUE-индекс страхует от гонок
+        cur = conn.execute(f'''
+            INSERT OR IGNORE INTO appointments (user_id, date, time, name, phone, barber_id)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM slot_holds
+                WHERE date = ? AND time = ? AND barber_id = ? AND user_id != ? AND expires_at >= ?
+            ) AND NOT {SLOT_CLOSED_SQL}
+        ''', (
+            user_id, date, time_str, name, phone, barber_id, date, time_str, barber_id, user_id, now,
+            date, barber_id, time_str, time_str,
+        ))
+        if cur.rowcount != 1:
+            return None
+        conn.execute(
+            "DELETE FROM slot_holds WHERE date = ? AND time = ? AND barber_id = ?", (date, time_str, barber_id)
+        )
+        return cur.lastrowid
+
+
+def _release_user_holds(conn, user_id: int):
+    with conn:
+        conn.execute("DELETE FROM slot_holds WHERE user_id = ?", (user_id,))
+
+
+def _active_holds(conn, now: float) -> list[tuple[str, str, int, int, float]]:
+    return conn.execute(
+        "SELECT date, time, barber_id, user_id, expires_at FROM slot_holds WHERE expires_at >= ?", (now,)
+    ).fetchall()
+
+
+def _expire_holds(conn, now: float) -> int:
+    with conn:
+        return conn.execute("DELETE FROM slot_holds WHERE expires_at < ?", (now,)).rowcount
+
+
+class Reservations:
+    # База — источник истины, а в памяти держим копию активных удержаний всех процессов для клавиатур:
+    # снимок из базы раз в HOLDS_REFRESH_INTERVAL плюс свои удержания сразу
+    def __init__(self, ttl: float = HOLD_TTL, refresh_interval: float = HOLDS_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._holds: dict[tuple[str, str, int], tuple[int, float]] = {}
+        self._refreshed_at: Optional[float] = None
+        # Одно чтение на всех, кто рисует клавиатуру в этот момент
+        self._refreshing: Optional[asyncio.Task] = None
+
+    async def _load_holds(self):
+        now = time.time()
+        rows = await db.database.run(_active_holds, now)
+        self._holds = {(d, t, barber_id): (user_id, expires_at) for d, t, barber_id, user_id, expires_at in rows}
+        self._refreshed_at = time.monotonic()
+
+    async def _refresh(self):
+        if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._load_holds())
+        try:
+            await asyncio.shield(self._refreshing)
+        except Exception as e:
+            # Клавиатуру всё равно показываем по старому снимку: бронь в базе проверяется отдельно
+            print(f"❌ Failed to read slot holds: {e}")
+
+    async def held_masks(self, date: str, exclude_user: Optional[int] = None) -> dict[int, int]:
+        # barber_id -> маска слотов, удержанных другими пользователями
+        await self._refresh()
+        now = time.time()
+        masks: dict[int, int] = {}
+        for (d, t, barber_id), (user_id, expires_at) in self._holds.items():
+            index = schedule.slot_index.get(t)
+            if d == date and index is not None and expires_at >= now and user_id != exclude_user:
+                masks[barber_id] = masks.get(barber_id, 0) | 1 << index
+        return masks
+
+    def _forget_user(self, user_id: int):
+        self._holds = {slot: hold for slot, hold in self._holds.items() if hold[0] != user_id}
+
+    async def hold(self, date: str, time_str: str, user_id: int, barber_ids: list[int]) -> Optional[int]:
+        # Пробуем кресла по очереди в одной транзакции; возвращаем id барбера, за которым удержан слот
+        if not barber_ids:
+            return None
+        now = time.time()
+        expires_at = now + self.ttl
+        barber_id = await db.database.run(_place_hold, date, time_str, barber_ids, user_id, now, expires_at)
+        if barber_id is None:
+            return None
+        self.track(date, time_str, barber_id, user_id, expires_at)
+        return barber_id
+
+    def track(self, date: str, time_str: str, barber_id: int, user_id: int, expires_at: float):
+        # Удержание уже записано в базу (например, листом ожидания) — отражаем его в памяти
+        self._forget_user(user_id)
+        self._holds[(date, time_str, barber_id)] = (user_id, expires_at)
+
+    async def book(
+        self, user_id: int, date: str, time_str: str, barber_id: int, name: str, phone: str
+    ) -> Optional[int]:
+        appointment_id = await db.database.run(
+            _book_held, user_id, date, time_str, barber_id, name, phone, time.time()
+        )
+        if appointment_id is not None:
+            self._holds.pop((date, time_str, barber_id), None)
+        return appointment_id
+
+    async def release(self, user_id: int):
+        await db.database.run(_release_user_holds, user_id)
+        self._forget_user(user_id)
+
+    async def run_expiry(self):
+        # Каждый просроченный hold удаляется одной короткой транзакцией по индексу expires_at
+        while True:
+            await asyncio.sleep(EXPIRE_INTERVAL)
+            now = time.time()
+            self._holds = {slot: hold for slot, hold in self._holds.items() if hold[1] >= now}
+            try:
+                await db.database.run(_expire_holds, now)
+            except Exception as e:
+                print(f"❌ Failed to expire slot holds: {e}")
+
+
+reservations = Reservations()
@@ -0,0 +1,168 @@
+import json
+import os
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import date as date_type, datetime, timedelta
+
+# Расписание можно переопределить файлом; без него — как раньше: одно кресло, Пн–Сб 10:00–19:00, слоты по часу
+SCHEDULE_PATH = os.getenv("SCHEDULE_PATH", "schedule.json")
+# На сколько дней вперёд можно записаться; дальше не показываем и не принимаем даты из кнопок
+BOOKING_HORIZON_DAYS = int(os.getenv("BOOKING_HORIZON_DAYS", "60"))
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+DEFAULT_SCHEDULE = {
+    "slot_minutes": 60,
+    "holidays": [],
+    "barbers": [
+        {
+            "id": 1,
+            "name": "Barber",
+            "hours": {day: "10:00-19:00" for day in WEEKDAYS[:6]},
+            "breaks": [],
+            "holidays": [],
+        }
+    ],
+}
+
+
+def _minutes(value: str) -> int:
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _format(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _span(value: str) -> tuple[int, int]:
+    start, end = value.split("-")
+    return _minutes(start), _minutes(end)
+
+
+@dataclass
+class Barber:
+    id: int
+    name: str
+    # Маска рабочих слотов для каждого дня недели (0 — понедельник), перерывы уже вычтены
+    weekday_masks: list[int]
+    holidays: set[str] = field(default_factory=set)
+
+
+class Schedule:
+    # Сетка слотов и маски считаются один раз при загрузке; дальше только битовые операции
+    def __init__(self, config: dict):
+        self.slot_minutes = config.get("slot_minutes", 60)
+        self.holidays = set(config.get("holidays", []))
+        # Каждая запись занимает ровно один слот: длительность в записи не хранится, и услуга длиннее слота
+        # перекрылась бы со следующей записью. Такие расписания не принимаем, а не молча игнорируем
+        too_long = [name for name, minutes in config.get("services", {}).items() if minutes > self.slot_minutes]
+        if too_long:
+            raise ValueError(
+                f"Services longer than slot_minutes ({self.slot_minutes}) are not supported: {', '.join(too_long)}"
+            )
+
+        starts = []
+        for barber in config["barbers"]:
+            for span in barber["hours"].values():
+                starts.append(_span(span))
+        day_start = min(start for start, _ in starts)
+        day_end = max(end for _, end in starts)
+
+        self.slot_starts = list(range(day_start, day_end - self.slot_minutes + 1, self.slot_minutes))
+        self.slot_times = [_format(m) for m in self.slot_starts]
+        self.slot_index = {t: i for i, t in enumerate(self.slot_times)}
+        self.full_mask = (1 << len(self.slot_times)) - 1
+
+        self.barbers = [self._build_barber(barber) for barber in config["barbers"]]
+        self.barber_by_id = {barber.id: barber for barber in self.barbers}
+        # Объединение по всем барберам: в какие дни недели вообще кто-то работает
+        self._open_weekdays = [
+            any(barber.weekday_masks[weekday] for barber in self.barbers) for weekday in range(7)
+        ]
+
+    def _range_mask(self, start: int, end: int) -> int:
+        mask = 0
+        for index, slot_start in enumerate(self.slot_starts):
+            if slot_start >= start and slot_start + self.slot_minutes <= end:
+                mask |= 1 << index
+        return mask
+
+    def _overlap_mask(self, start: int, end: int) -> int:
+        mask = 0
+        for index, slot_start in enumerate(self.slot_starts):
+            if slot_start < end and slot_start + self.slot_minutes > start:
+                mask |= 1 << index
+        return mask
+
+    def _build_barber(self, config: dict) -> Barber:
+        breaks = 0
+        for span in config.get("breaks", []):
+            breaks |= self._overlap_mask(*_span(span))
+        weekday_masks = []
+        for weekday in WEEKDAYS:
+            span = config["hours"].get(weekday)
+            weekday_masks.append(self._range_mask(*_span(span)) & ~breaks if span else 0)
+        return Barber(config["id"], config.get("name", str(config["id"])), weekday_masks, set(config.get("holidays", [])))
+
+    def working_mask(self, barber: Barber, day: date_type) -> int:
+        day_str = day.strftime("%Y-%m-%d")
+        if day_str in self.holidays or day_str in barber.holidays:
+            return 0
+        return barber.weekday_masks[day.weekday()]
+
+    def is_working_day(self, day: date_type) -> bool:
+        if not self._open_weekdays[day.weekday()]:
+            return False
+        return any(self.working_mask(barber, day) for barber in self.barbers)
+
+    def free_masks(self, day: date_type, busy: dict[int, int]) -> dict[int, int]:
+        # busy — занятые (или удержанные) слоты по id барбера
+        return {
+            barber.id: self.working_mask(barber, day) & ~busy.get(barber.id, 0)
+            for barber in self.barbers
+        }
+
+    def available_mask(self, day: date_type, busy: dict[int, int]) -> int:
+        # Время доступно, если свободно хотя бы одно кресло
+        mask = 0
+        for barber_mask in self.free_masks(day, busy).values():
+            mask |= barber_mask
+        return mask
+
+    def barbers_free_at(self, day: date_type, time_str: str, busy: dict[int, int]) -> list[int]:
+        index = self.slot_index.get(time_str)
+        if index is None:
+            return []
+        bit = 1 << index
+        free = self.free_masks(day, busy)
+        return [barber_id for barber_id, mask in free.items() if mask & bit]
+
+    def after_mask(self, minutes: int) -> int:
+        # Слоты, начинающиеся строго позже указанной минуты дня
+        return self.full_mask & ~((1 << bisect_right(self.slot_starts, minutes)) - 1)
+
+    def times(self, mask: int) -> list[str]:
+        return [t for index, t in enumerate(self.slot_times) if mask >> index & 1]
+
+    def barber_name(self, barber_id: int) -> str:
+        barber = self.barber_by_id.get(barber_id)
+        return barber.name if barber else str(barber_id)
+
+
+def load_schedule(path: str = SCHEDULE_PATH) -> Schedule:
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return Schedule(json.load(f))
+    return Schedule(DEFAULT_SCHEDULE)
+
+
+def horizon_end(today: date_type) -> date_type:
+    return today + timedelta(days=BOOKING_HORIZON_DAYS)
+
+
+def minutes_of(moment: datetime) -> int:
+    return moment.hour * 60 + moment.minute
+
+
+schedule = load_schedule()
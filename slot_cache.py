@@ -0,0 +1,215 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db
+from schedule import schedule, horizon_end
+
+# Сколько дней вперёд загружаем одним запросом
+WARM_DAYS = 21
+# Сколько секунд доверяем загруженному диапазону (0 — всегда). Записи других процессов приходят
+# через журнал изменений, а закрытия админом — нет: в нескольких воркерах их подхватывает TTL
+SLOT_CACHE_TTL = float(os.getenv("SLOT_CACHE_TTL", "0"))
+
+
+def _to_str(day) -> str:
+    return day if isinstance(day, str) else day.strftime("%Y-%m-%d")
+
+
+class SlotCache:
+    # Для каждой даты и барбера храним битовую маску занятых слотов: бит i = schedule.slot_times[i] занят
+    def __init__(self, warm_days: int = WARM_DAYS, ttl: float = SLOT_CACHE_TTL):
+        self.warm_days = warm_days
+        self.ttl = ttl
+        self._loaded_at = 0.0
+        self._masks: dict[str, dict[int, int]] = {}
+        # Закрытые админом слоты — отдельно от занятых, чтобы не попадать в число записей
+        self._closed: dict[str, dict[int, int]] = {}
+        self._loaded_from: Optional[str] = None
+        self._loaded_to: Optional[str] = None
+        # Текущая загрузка: все, кому нужен ещё не загруженный день, ждут её одну, а не встают
+        # в очередь за блокировкой, где каждого будят отдельной итерацией event loop
+        self._loading: Optional[asyncio.Task] = None
+        # Изменения, пришедшие пока идёт загрузка диапазона, переигрываем поверх результата
+        self._pending: Optional[list[tuple[str, int, int, bool]]] = None
+        # Растёт при каждом clear(): загрузка, начатая до сброса, свой результат выбрасывает
+        self._generation = 0
+
+    def _is_loaded(self, day: str) -> bool:
+        return (
+            self._loaded_from is not None
+            and self._loaded_from <= day <= self._loaded_to
+        )
+
+    def _evict_old(self, today: str):
+        if self._loaded_from is not None and self._loaded_from < today:
+            self._masks = {d: m for d, m in self._masks.items() if d >= today}
+            self._closed = {d: m for d, m in self._closed.items() if d >= today}
+            self._loaded_from = today if self._loaded_to >= today else None
+            if self._loaded_from is None:
+                self._loaded_to = None
+
+    async def _load(self, start: str, until: str):
+        end = (datetime.strptime(start, "%Y-%m-%d") + timedelta(days=self.warm_days)).strftime("%Y-%m-%d")
+        # until приходит из выбранной пользователем даты — дальше горизонта записи кеш не растёт
+        end = min(max(end, until), _horizon(start))
+        generation = self._generation
+        pending = self._pending = []
+        try:
+            # Оба чтения — внутри окна pending, иначе запись, сделанная между ними, потерялась бы
+            rows = await db.get_booked_slots_between(start, end)
+            closures = await db.get_closures_between(start, end)
+        finally:
+            if self._pending is pending:
+                self._pending = None
+        if generation != self._generation:
+            # Пока читали, кеш сбросили (TTL, закрытие дней, сброс журнала изменений): данные могли устареть,
+            # а продолжение старого диапазона после сброса сдвинуло бы _loaded_from за сегодняшний день
+            return
+
+        masks = _masks_from_rows(rows)
+        for day, barber_id, bit, booked in pending:
+            _apply_bit(masks.setdefault(day, {}), barber_id, bit, booked)
+        closed = _closed_from_rows(closures)
+
+        for day in _date_range(start, end):
+            self._masks[day] = masks.get(day, {})
+            self._closed[day] = closed.get(day, {})
+        if self._loaded_from is None:
+            self._loaded_from = start
+            self._loaded_at = time.monotonic()
+        self._loaded_to = end
+
+    def _load_done(self, task: asyncio.Task):
+        if self._loading is task:
+            self._loading = None
+
+    async def _ensure_loaded(self, day: str, today: str):
+        while not self._is_loaded(day):
+            if self._loading is None:
+                # Догружаем одним запросом всё, что идёт сразу после уже загруженного диапазона
+                start = today if self._loaded_to is None else _next_day(self._loaded_to)
+                self._loading = asyncio.ensure_future(self._load(start, day))
+                self._loading.add_done_callback(self._load_done)
+            # shield: отмена одного ждущего не должна обрывать загрузку для остальных
+            await asyncio.shield(self._loading)
+
+    async def _refresh(self, day: str, today: str):
+        self._evict_old(today)
+        if self.ttl and self._loaded_from is not None and time.monotonic() - self._loaded_at > self.ttl:
+            self.clear()
+        await self._ensure_loaded(day, today)
+
+    async def busy_masks(self, day) -> dict[int, int]:
+        # barber_id -> маска занятых слотов
+        day = _to_str(day)
+        today = datetime.now().strftime("%Y-%m-%d")
+        if day < today or day > _horizon(today):
+            # Прошедшие и слишком далёкие даты в кеше не держим
+            return _masks_from_rows(await db.get_booked_slots_between(day, day)).get(day, {})
+        await self._refresh(day, today)
+        return self._masks.get(day, {})
+
+    async def closed_masks(self, day) -> dict[int, int]:
+        # barber_id -> маска слотов, закрытых админом; прошедшие дни никому не показываются
+        day = _to_str(day)
+        today = datetime.now().strftime("%Y-%m-%d")
+        if day < today:
+            return {}
+        if day > _horizon(today):
+            return _closed_from_rows(await db.get_closures_between(day, day)).get(day, {})
+        await self._refresh(day, today)
+        return self._closed.get(day, {})
+
+    async def booked_count(self, day) -> int:
+        return sum(mask.bit_count() for mask in (await self.busy_masks(day)).values())
+
+    def _apply(self, day, time: str, barber_id: int, booked: bool):
+        day = _to_str(day)
+        index = schedule.slot_index.get(time)
+        if index is None:
+            return
+        bit = 1 << index
+        if self._pending is not None:
+            self._pending.append((day, barber_id, bit, booked))
+        if self._is_loaded(day):
+            _apply_bit(self._masks.setdefault(day, {}), barber_id, bit, booked)
+
+    def mark_booked(self, day, time: str, barber_id: int):
+        self._apply(day, time, barber_id, True)
+
+    def mark_free(self, day, time: str, barber_id: int):
+        self._apply(day, time, barber_id, False)
+
+    def apply_changes(self, changes):
+        # Дельты из журнала; свои же изменения приходят повторно, но битовые операции идемпотентны
+        for change in changes:
+            a = change.appointment
+            if change.op == "insert":
+                self.mark_booked(a.date, a.time, a.barber_id)
+            elif change.op == "delete":
+                # archive не трогаем: архиватор переносит прошедшие записи, слот был занят
+                self.mark_free(a.date, a.time, a.barber_id)
+
+    def clear(self):
+        self._generation += 1
+        # Идущую загрузку не ждём: она всё равно выбросит результат, следующий запрос начнёт новую
+        self._loading = None
+        self._masks.clear()
+        self._closed.clear()
+        self._loaded_from = self._loaded_to = None
+
+
+def _apply_bit(masks: dict[int, int], barber_id: int, bit: int, booked: bool):
+    mask = masks.get(barber_id, 0)
+    masks[barber_id] = mask | bit if booked else mask & ~bit
+
+
+def _masks_from_rows(rows) -> dict[str, dict[int, int]]:
+    masks: dict[str, dict[int, int]] = {}
+    for day, time_str, barber_id in rows:
+        index = schedule.slot_index.get(time_str)
+        if index is not None:
+            _apply_bit(masks.setdefault(day, {}), barber_id, 1 << index, True)
+    return masks
+
+
+def span_mask(start_time: str, end_time: str) -> int:
+    # Слоты, которые начинаются в [start_time, end_time)
+    mask = 0
+    for index, time_str in enumerate(schedule.slot_times):
+        if start_time <= time_str < end_time:
+            mask |= 1 << index
+    return mask
+
+
+def _closed_from_rows(rows) -> dict[str, dict[int, int]]:
+    closed: dict[str, dict[int, int]] = {}
+    for day, start_time, end_time, barber_id in rows:
+        mask = span_mask(start_time, end_time)
+        masks = closed.setdefault(day, {})
+        for barber in schedule.barbers:
+            if barber_id is None or barber.id == barber_id:
+                masks[barber.id] = masks.get(barber.id, 0) | mask
+    return closed
+
+
+def _horizon(day: str) -> str:
+    return horizon_end(datetime.strptime(day, "%Y-%m-%d").date()).strftime("%Y-%m-%d")
+
+
+def _next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _date_range(start: str, end: str):
+    current = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    while current <= last:
+        yield current.strftime("%Y-%m-%d")
+        current += timedelta(days=1)
+
+
+cache = SlotCache()
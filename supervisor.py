@@ -0,0 +1,205 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import sys
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+import webhook
+
+# python supervisor.py — запускает WORKERS процессов main.py с общей базой. Апдейты получает сам супервизор
+# (getUpdates или вебхук, по BOT_MODE) и раздаёт воркерам по пользователю; фоновые задачи выбирают
+# лидера через аренду в базе (leader.py)
+load_dotenv()
+API_TOKEN = os.getenv("BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WORKERS = int(os.getenv("WORKERS", "2"))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+POLL_TIMEOUT = 30
+FORWARD_RETRY_DELAY = 1.0
+# Упавший воркер перезапускаем; если он падает сразу после старта, пауза растёт до RESTART_DELAY_MAX
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 30.0
+STABLE_UPTIME = 30.0
+# Записи соседних процессов воркер получает из журнала изменений, а закрытия админом — нет,
+# поэтому кеш слотов всё же перечитывается раз в минуту
+WORKER_ENV_DEFAULTS = {"SLOT_CACHE_TTL": "60"}
+
+
+def routing_key(update: dict) -> int:
+    # Все апдейты одного пользователя — в один воркер: там его FSM-состояние, сводка и очередь исходящих
+    for value in update.values():
+        if isinstance(value, dict):
+            for field in ("from", "user", "chat"):
+                owner = value.get(field)
+                if isinstance(owner, dict) and isinstance(owner.get("id"), int):
+                    return owner["id"]
+    return update.get("update_id", 0)
+
+
+class Worker:
+    def __init__(self, index: int, secret: str):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.url = f"http://{webhook.WORKER_HOST}:{self.port}{webhook.WORKER_PATH}"
+        self.secret = secret
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stopping = False
+
+    def _env(self) -> dict[str, str]:
+        env = {**WORKER_ENV_DEFAULTS, **os.environ}
+        env.update(BOT_MODE="worker", WORKER_PORT=str(self.port), WORKER_SECRET=self.secret)
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics_port:
+            env["METRICS_PORT"] = str(metrics_port + 1 + self.index)
+        return env
+
+    async def keep_running(self):
+        delay = RESTART_DELAY
+        while not self.stopping:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=self._env())
+            code = await self.process.wait()
+            if self.stopping:
+                return
+            if time.monotonic() - started >= STABLE_UPTIME:
+                delay = RESTART_DELAY
+            print(f"⚠️ Worker {self.index} exited with code {code}, restarting in {delay:g}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    async def stop(self, timeout: float):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKERS):
+        if workers < 1:
+            raise ValueError("WORKERS must be at least 1")
+        secret = secrets.token_hex(16)
+        self.workers = [Worker(index, secret) for index in range(workers)]
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def worker_for(self, update: dict) -> Worker:
+        return self.workers[routing_key(update) % len(self.workers)]
+
+    async def forward(self, update: dict, raw: Optional[bytes] = None) -> bool:
+        worker = self.worker_for(update)
+        headers = {webhook.SECRET_HEADER: worker.secret, "Content-Type": "application/json"}
+        try:
+            async with self._session.post(worker.url, data=raw or json.dumps(update), headers=headers) as response:
+                return response.status == 200
+        except aiohttp.ClientError:
+            # Воркер ещё не поднялся или перезапускается
+            return False
+
+    async def _api(self, method: str, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+        url = API_URL.format(token=API_TOKEN, method=method)
+        async with self._session.post(url, json=params, timeout=timeout) as response:
+            payload = await response.json()
+        if not payload.get("ok"):
+            raise RuntimeError(f"{method} failed: {payload.get('description')}")
+        return payload["result"]
+
+    async def _deliver(self, updates: list[dict]):
+        # Апдейты одного воркера — по порядку, разные воркеры получают свои параллельно
+        batches: dict[int, list[dict]] = {}
+        for update in updates:
+            batches.setdefault(self.worker_for(update).index, []).append(update)
+
+        async def deliver_batch(batch: list[dict]):
+            for update in batch:
+                while not await self.forward(update):
+                    await asyncio.sleep(FORWARD_RETRY_DELAY)
+
+        await asyncio.gather(*(deliver_batch(batch) for batch in batches.values()))
+
+    async def poll(self):
+        # getUpdates вызывает только супервизор; offset сдвигаем, когда всё полученное уже у воркеров
+        await self._api("deleteWebhook", drop_pending_updates=True)
+        offset = None
+        while True:
+            try:
+                updates = await self._api("getUpdates", offset=offset, timeout=POLL_TIMEOUT)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                print(f"❌ getUpdates failed: {e}")
+                await asyncio.sleep(FORWARD_RETRY_DELAY)
+                continue
+            if updates:
+                await self._deliver(updates)
+                offset = updates[-1]["update_id"] + 1
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+
+        async def handle_update(request: web.Request) -> web.Response:
+            if not hmac.compare_digest(request.headers.get(webhook.SECRET_HEADER, ""), webhook.WEBHOOK_SECRET):
+                return web.Response(status=401)
+            raw = await request.read()
+            try:
+                update = json.loads(raw)
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(update, dict):
+                return web.Response(status=400)
+            # Воркер недоступен или переполнен — Telegram повторит доставку
+            return web.Response(status=200 if await self.forward(update, raw) else 503)
+
+        app.router.add_post(webhook.WEBHOOK_PATH, handle_update)
+        return app
+
+    async def run(self):
+        if not API_TOKEN:
+            raise ValueError("BOT_TOKEN не найден в переменных окружения")
+        if BOT_MODE == "webhook" and not webhook.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL не найден в переменных окружения")
+        self._session = aiohttp.ClientSession()
+        keepers = [asyncio.create_task(worker.keep_running()) for worker in self.workers]
+        print(f"Supervisor started with {len(self.workers)} workers...")
+        try:
+            if BOT_MODE == "webhook":
+                async def register():
+                    await self._api(
+                        "setWebhook", url=webhook.WEBHOOK_URL, secret_token=webhook.WEBHOOK_SECRET,
+                        drop_pending_updates=False,
+                    )
+
+                await webhook.serve(self.create_app(), webhook.WEBHOOK_HOST, webhook.WEBHOOK_PORT, register)
+            else:
+                poller = asyncio.create_task(self.poll())
+                try:
+                    await webhook.wait_for_stop_signal()
+                finally:
+                    poller.cancel()
+                    await asyncio.gather(poller, return_exceptions=True)
+        finally:
+            for worker in self.workers:
+                worker.stopping = True
+            for task in keepers:
+                task.cancel()
+            await asyncio.gather(*keepers, return_exceptions=True)
+            # Воркеры дорабатывают принятые апдейты и отдают аренду лидера
+            await asyncio.gather(*(worker.stop(webhook.DRAIN_TIMEOUT + 5) for worker in self.workers))
+            await self._session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(Supervisor().run())
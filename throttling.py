@@ -0,0 +1,95 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import CallbackQuery
+
+import metrics
+from delivery import TokenBucket
+from outbox import outbox
+
+# На каждую пару (пользователь, префикс callback_data) — своё ведро: THROTTLE_RATE нажатий в секунду,
+# не больше THROTTLE_BURST подряд
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "4"))
+# Повтор той же кнопки на том же, не перерисованном с тех пор сообщении в пределах этого окна — двойное нажатие
+DEBOUNCE_SECONDS = float(os.getenv("THROTTLE_DEBOUNCE", "1.0"))
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "10000"))
+# Ведро, которым давно не пользовались, снова полное — его можно просто забыть
+THROTTLE_IDLE_TTL = 60
+
+
+class _Entry:
+    __slots__ = ("bucket", "last_payload", "last_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.last_payload = None
+        self.last_at = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Внешний middleware на callback_query: отбрасываем лишние нажатия до фильтров и хендлеров
+    def __init__(
+        self,
+        rate: float = THROTTLE_RATE,
+        burst: float = THROTTLE_BURST,
+        debounce: float = DEBOUNCE_SECONDS,
+        max_keys: int = THROTTLE_MAX_KEYS,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.debounce = debounce
+        self.max_keys = max_keys
+        # Порядок — по последнему обращению, поэтому протухшие и лишние ключи всегда в начале
+        self._entries: OrderedDict[tuple[int, str], _Entry] = OrderedDict()
+
+    def _entry(self, key: tuple[int, str], now: float) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry(self.rate, self.burst)
+        else:
+            self._entries.move_to_end(key)
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_keys and now - oldest.last_at < THROTTLE_IDLE_TTL:
+                break
+            if oldest is entry:
+                break
+            del self._entries[oldest_key]
+        return entry
+
+    def check(self, user_id: int, data: str, message_id: int, edits: int = 0) -> str:
+        # "" — пропускаем, иначе причина отказа. edits — сколько раз перерисовывали сообщения в чате:
+        # после перерисовки та же кнопка на том же message_id — уже новое нажатие, а не повтор
+        now = time.monotonic()
+        entry = self._entry((user_id, data.split(":", 1)[0]), now)
+        payload = (data, message_id, edits)
+        if payload == entry.last_payload and now - entry.last_at < self.debounce:
+            entry.last_at = now
+            return "debounce"
+        entry.last_payload = payload
+        entry.last_at = now
+        return "" if entry.bucket.try_acquire() else "rate"
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: dict[str, Any],
+    ) -> Any:
+        message_id = event.message.message_id if event.message else 0
+        edits = outbox.edit_count(event.message.chat.id) if event.message else 0
+        reason = self.check(event.from_user.id, event.data or "", message_id, edits)
+        if not reason:
+            return await handler(event, data)
+        metrics.throttled_updates.inc(reason=reason)
+        # Ответ нужен, чтобы у клиента пропали «часики»; больше никаких запросов к API и базе
+        await event.answer("⏳ Too many taps, please wait a moment." if reason == "rate" else None)
+        return None
+
+
+def setup(dp: Router):
+    dp.callback_query.outer_middleware(ThrottlingMiddleware())
@@ -0,0 +1,108 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "10000"))
+
+
+def _week_bounds(now: datetime) -> tuple[str, str]:
+    start = now.date() - timedelta(days=now.weekday())
+    return start.strftime("%Y-%m-%d"), (start + timedelta(days=6)).strftime("%Y-%m-%d")
+
+
+@dataclass
+class UserSummary:
+    last: Optional[db.Appointment]
+    # Записи начиная с дня загрузки, по возрастанию (date, time); прошедшие отсекаем при чтении
+    upcoming: list[db.Appointment]
+    week_start: str
+    week_end: str
+    week_count: int
+
+    def upcoming_after(self, date: str, time: str) -> list[db.Appointment]:
+        return [a for a in self.upcoming if (a.date, a.time) > (date, time)]
+
+    def in_week(self, appointment: db.Appointment) -> bool:
+        return self.week_start <= appointment.date <= self.week_end
+
+
+class SummaryCache:
+    # LRU сводок по пользователю: последняя запись, предстоящие записи и число записей на этой неделе
+    def __init__(self, size: int = SUMMARY_CACHE_SIZE):
+        self.size = size
+        self._cache: OrderedDict[int, UserSummary] = OrderedDict()
+        # Пользователи, для которых сейчас идёт загрузка, и был ли за это время booking/cancel
+        self._loading: dict[int, bool] = {}
+
+    async def get(self, user_id: int) -> UserSummary:
+        now = datetime.now()
+        week_start, week_end = _week_bounds(now)
+        summary = self._cache.get(user_id)
+        if summary is not None and summary.week_start == week_start:
+            self._cache.move_to_end(user_id)
+            return summary
+
+        self._loading[user_id] = False
+        try:
+            last, upcoming, week_count = await db.get_user_summary(
+                user_id, now.strftime("%Y-%m-%d"), week_start, week_end
+            )
+        finally:
+            changed = self._loading.pop(user_id)
+        summary = UserSummary(last, upcoming, week_start, week_end, week_count)
+        # Если запись изменилась во время загрузки, результат мог устареть — не кешируем его
+        if not changed:
+            self._cache[user_id] = summary
+            self._cache.move_to_end(user_id)
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return summary
+
+    def _touch(self, user_id: int) -> Optional[UserSummary]:
+        if user_id in self._loading:
+            self._loading[user_id] = True
+        return self._cache.get(user_id)
+
+    def on_booked(self, appointment: db.Appointment):
+        summary = self._touch(appointment.user_id)
+        if summary is None or any(a.id == appointment.id for a in summary.upcoming):
+            # Уже учтена: сводку загрузили после записи или это повтор из журнала изменений
+            return
+        summary.upcoming.append(appointment)
+        summary.upcoming.sort(key=lambda a: (a.date, a.time))
+        if summary.last is None or (appointment.date, appointment.time) >= (summary.last.date, summary.last.time):
+            summary.last = appointment
+        if summary.in_week(appointment):
+            summary.week_count += 1
+
+    def on_cancelled(self, appointment: db.Appointment):
+        summary = self._touch(appointment.user_id)
+        if summary is None:
+            return
+        if summary.last is not None and summary.last.id == appointment.id:
+            # Какая запись стала последней, знает только база — перечитаем при следующем обращении
+            del self._cache[appointment.user_id]
+            return
+        if all(a.id != appointment.id for a in summary.upcoming):
+            return
+        summary.upcoming = [a for a in summary.upcoming if a.id != appointment.id]
+        if summary.in_week(appointment):
+            summary.week_count -= 1
+
+    def apply_changes(self, changes):
+        for change in changes:
+            # archive — запись просто переехала в историю, для сводки она по-прежнему есть
+            if change.op == "insert":
+                self.on_booked(change.appointment)
+            elif change.op == "delete":
+                self.on_cancelled(change.appointment)
+
+    def clear(self):
+        self._cache.clear()
+
+
+summaries = SummaryCache()
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import db
+import delivery
+import metrics
+from callbacks import ClaimOffer
+from reservations import _insert_hold, reservations
+
+# Сколько освободившийся слот придержан за первым в очереди, прежде чем он перейдёт следующему
+CLAIM_WINDOW = float(os.getenv("WAITLIST_CLAIM_WINDOW", str(5 * 60)))
+# Как часто проверяем просроченные предложения; освобождение слота будит цикл сразу
+WAITLIST_INTERVAL = float(os.getenv("WAITLIST_INTERVAL", "15"))
+WAITLIST_MAX_PER_USER = int(os.getenv("WAITLIST_MAX_PER_USER", "3"))
+# Сколько первых в очереди просматриваем на один слот (часть может быть занята другим предложением)
+CANDIDATES_PER_SLOT = 20
+
+Slot = tuple[str, str, int]  # дата, время, барбер
+
+
+def _join(conn, user_id: int, date: str, time_str: Optional[str], now: float, limit: int) -> str:
+    with conn:
+        exists = conn.execute(
+            "SELECT 1 FROM waitlist WHERE user_id = ? AND date = ? AND IFNULL(time, '') = IFNULL(?, '')",
+            (user_id, date, time_str)
+        ).fetchone()
+        if exists:
+            return "exists"
+        count = conn.execute("SELECT COUNT(*) FROM waitlist WHERE user_id = ?", (user_id,)).fetchone()[0]
+        if count >= limit:
+            return "limit"
+        conn.execute(
+            "INSERT INTO waitlist (user_id, date, time, created_at) VALUES (?, ?, ?, ?)",
+            (user_id, date, time_str, now)
+        )
+        return "joined"
+
+
+def _make_offers(conn, slots: list[Slot], now: float, expires_at: float) -> list[tuple[int, int, str, str, int]]:
+    # Для каждого слота — первый в очереди, кто сейчас ничего не бронирует и ещё не записан на этот день.
+    # Слот сразу удерживается за ним в той же транзакции
+    offers = []
+    offered_users = set()
+    with conn:
+        for date, time_str, barber_id in slots:
+            rows = conn.execute('''
+                SELECT id, user_id FROM waitlist w
+                WHERE date = ? AND (time = ? OR time IS NULL) AND offer_expires IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM slot_holds h WHERE h.user_id = w.user_id AND h.expires_at >= ?)
+                  AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.user_id = w.user_id AND a.date = w.date)
+                ORDER BY id LIMIT ?
+            ''', (date, time_str, now, CANDIDATES_PER_SLOT)).fetchall()
+            candidate = next(((entry_id, user_id) for entry_id, user_id in rows if user_id not in offered_users), None)
+            # Слот могли уже занять или удержать — тогда предлагать нечего
+            if candidate is None or not _insert_hold(conn, date, time_str, barber_id, candidate[1], now, expires_at):
+                continue
+            conn.execute(
+                "UPDATE waitlist SET offer_time = ?, offer_barber = ?, offer_expires = ? WHERE id = ?",
+                (time_str, barber_id, expires_at, candidate[0])
+            )
+            offered_users.add(candidate[1])
+            offers.append((candidate[0], candidate[1], date, time_str, barber_id))
+    return offers
+
+
+def _expire_offers(conn, now: float, today: str) -> list[Slot]:
+    with conn:
+        rows = conn.execute(
+            "SELECT id, date, offer_time, offer_barber FROM waitlist WHERE offer_expires < ?", (now,)
+        ).fetchall()
+        # Не успел — место в очереди теряется, слот уходит следующему
+        conn.executemany("DELETE FROM waitlist WHERE id = ?", [(entry_id,) for entry_id, *_ in rows])
+        conn.execute("DELETE FROM waitlist WHERE date < ?", (today,))
+    return [(date, time_str, barber_id) for _, date, time_str, barber_id in rows]
+
+
+def _claim(conn, entry_id: int, user_id: int, now: float) -> Optional[Slot]:
+    with conn:
+        row = conn.execute(
+            "SELECT date, offer_time, offer_barber FROM waitlist WHERE id = ? AND user_id = ? AND offer_expires >= ?",
+            (entry_id, user_id, now)
+        ).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM waitlist WHERE id = ?", (entry_id,))
+    return tuple(row) if row is not None else None
+
+
+class Waitlist:
+    # Отмены только складывают освободившиеся слоты в список; поиск ожидающих и рассылка — в фоне,
+    # одной пачкой на всё, что освободилось с прошлого пробуждения
+    def __init__(self, claim_window: float = CLAIM_WINDOW, interval: float = WAITLIST_INTERVAL):
+        self.claim_window = claim_window
+        self.interval = interval
+        self._freed: list[Slot] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    def _event(self) -> asyncio.Event:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        return self._wake
+
+    async def join(self, user_id: int, date: str, time_str: Optional[str] = None) -> str:
+        # "joined", "exists" или "limit"
+        return await db.database.run(_join, user_id, date, time_str, time.time(), WAITLIST_MAX_PER_USER)
+
+    def on_freed(self, appointment: db.Appointment):
+        if f"{appointment.date} {appointment.time}" > datetime.now().strftime("%Y-%m-%d %H:%M"):
+            self._freed.append((appointment.date, appointment.time, appointment.barber_id))
+            self._event().set()
+
+    async def claim(self, entry_id: int, user_id: int) -> Optional[Slot]:
+        slot = await db.database.run(_claim, entry_id, user_id, time.time())
+        metrics.waitlist_offers.inc(outcome="claimed" if slot is not None else "late")
+        return slot
+
+    async def _offer(self, bot, slots: list[Slot]):
+        now = time.time()
+        expires_at = now + self.claim_window
+        offers = await db.database.run(_make_offers, slots, now, expires_at)
+        if not offers:
+            return
+        for _, user_id, date, time_str, barber_id in offers:
+            reservations.track(date, time_str, barber_id, user_id, expires_at)
+
+        minutes = max(1, round(self.claim_window / 60))
+        errors = await delivery.send_many(bot, [
+            (
+                user_id,
+                f"🎉 A slot opened up on {datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y')} at {time_str}!\n"
+                f"It's held for you for {minutes} min, tap below to book it.",
+                {"reply_markup": InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="✅ Book it", callback_data=ClaimOffer(id=entry_id).pack())]
+                ])},
+            )
+            for entry_id, user_id, date, time_str, _ in offers
+        ])
+        for error in errors:
+            metrics.waitlist_offers.inc(outcome="sent" if error is None else "failed")
+
+    async def _wait(self, delay: float):
+        event = self._event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def run(self, bot):
+        while True:
+            await self._wait(self.interval)
+            slots, self._freed = self._freed, []
+            try:
+                expired = await db.database.run(_expire_offers, time.time(), datetime.now().strftime("%Y-%m-%d"))
+                if expired:
+                    metrics.waitlist_offers.inc(len(expired), outcome="expired")
+                await self._offer(bot, slots + expired)
+            except Exception as e:
+                print(f"❌ Failed to process waitlist: {e}")
+                # Освободившиеся слоты больше нигде не записаны — вернём их на следующий проход
+                self._freed = slots + self._freed
+
+
+waitlist = Waitlist()
@@ -0,0 +1,136 @@
+import asyncio
+import hmac
+import os
+import secrets
+import signal
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://example.com/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Без секрета публичный адрес принял бы поддельный апдейт от кого угодно, в том числе «от админа».
+# Не задан — генерируем свой на каждый запуск: set_webhook всё равно регистрирует его заново
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько секунд ждём обработки уже принятых апдейтов при остановке
+DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+# Режим воркера (BOT_MODE=worker): supervisor.py задаёт порт и общий секрет каждому процессу
+WORKER_HOST = "127.0.0.1"
+WORKER_PORT = int(os.getenv("WORKER_PORT", "8100"))
+WORKER_PATH = "/update"
+WORKER_SECRET = os.getenv("WORKER_SECRET")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+QUEUE_KEY = web.AppKey("update_queue", asyncio.Queue)
+WORKERS_KEY = web.AppKey("update_workers", list)
+
+
+async def _worker(dp: Dispatcher, bot: Bot, queue: asyncio.Queue):
+    while True:
+        update = await queue.get()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"❌ Failed to process update {update.update_id}: {e}")
+        finally:
+            queue.task_done()
+
+
+def create_app(
+    dp: Dispatcher,
+    bot: Bot,
+    secret: str = WEBHOOK_SECRET,
+    path: str = WEBHOOK_PATH,
+    workers: int = WEBHOOK_WORKERS,
+    queue_size: int = WEBHOOK_QUEUE_SIZE,
+) -> web.Application:
+    if not secret:
+        raise ValueError("Webhook endpoint needs a secret token")
+    app = web.Application()
+    accepting = True
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        if not accepting:
+            # Telegram повторит апдейт позже, уже на новый процесс
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            app[QUEUE_KEY].put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        queue = asyncio.Queue(maxsize=queue_size)
+        app[QUEUE_KEY] = queue
+        app[WORKERS_KEY] = [asyncio.create_task(_worker(dp, bot, queue)) for _ in range(workers)]
+
+    async def on_shutdown(app: web.Application):
+        nonlocal accepting
+        accepting = False
+        try:
+            await asyncio.wait_for(app[QUEUE_KEY].join(), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Dropped {app[QUEUE_KEY].qsize()} updates on shutdown")
+        for task in app[WORKERS_KEY]:
+            task.cancel()
+        await asyncio.gather(*app[WORKERS_KEY], return_exceptions=True)
+
+    app.router.add_post(path, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
+
+
+async def serve(app: web.Application, host: str, port: int, on_started: Optional[Callable[[], Awaitable]] = None):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    try:
+        if on_started is not None:
+            await on_started()
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не найден в переменных окружения")
+
+    async def register():
+        # Апдейты, пришедшие пока бот был выключен, Telegram доставит сам
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, drop_pending_updates=False)
+
+    await serve(create_app(dp, bot), WEBHOOK_HOST, WEBHOOK_PORT, register)
+
+
+async def run_worker(dp: Dispatcher, bot: Bot):
+    # Воркер под supervisor.py: апдейты приходят не от Telegram, а от супервизора по локальному HTTP,
+    # вебхук регистрирует сам супервизор
+    await serve(create_app(dp, bot, secret=WORKER_SECRET, path=WORKER_PATH), WORKER_HOST, WORKER_PORT)